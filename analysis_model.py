@@ -1,21 +1,50 @@
+import os
+import copy
+import time
+import numpy as np
 import pandas as pd
-import vaderSentiment.vaderSentiment as vader
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import textblob as tb
 import textblob.sentiments
 import textblob.classifiers
+import textblob.tokenizers
+import textblob.utils
+
+import scipy.sparse
 
 import sklearn as skl
 import sklearn.feature_extraction.text
 import sklearn.naive_bayes
 import sklearn.svm
+import sklearn.linear_model
+
+from feature_store import CachedVectorizer
+from vader_engine import VaderEngine
+
+
+#region batch workers
+# Model owned by a classify_chunks worker process
+_batch_model = None
 
+def _init_batch_worker(model):
+    global _batch_model
+    _batch_model = model
+    _batch_model.prepare()
+
+def _classify_batch_chunk(chunk):
+    return _batch_model.classify(chunk)
+#endregion
 
 #region base classes
 class BaseModel:
     """
     Skeleton of other models
     """
+    # Chunks of a batch are worth classifying in parallel, data_analyzer runs the other models one per worker instead
+    parallel_classify = True
+
     def __init__(self, name):
         self.name = name
 
@@ -25,6 +54,57 @@ class BaseModel:
     def train(self, x: pd.Series, y: pd.Series):
         print("Training unavailable")
 
+    def use_feature_store(self, store):
+        # Only models with a vectorizer make use of the feature store
+        pass
+
+    def prepare(self):
+        # Set up expensive resources before classifying, called once per batch worker
+        pass
+
+    def classify_batch(self, texts, chunk_size=1000, workers=1) -> pd.Series:
+        # Classify a Series or any iterable of texts, spread in chunks over worker processes (0 uses all cores)
+        workers = workers or os.cpu_count()
+        x = texts if isinstance(texts, pd.Series) else pd.Series(list(texts), dtype=object)
+        if workers == 1 or len(x) <= chunk_size:
+            # One process gains nothing from chunks, and the feature store caches the matrix of the whole series
+            chunks = [x]
+        else:
+            chunks = (x.iloc[start:start + chunk_size] for start in range(0, len(x), chunk_size))
+        results = list(self.classify_chunks(chunks, workers))
+        if not results:
+            return pd.Series(index=x.index, dtype='int64')
+        return pd.concat(results)
+
+    def classify_chunks(self, chunks, workers=1):
+        # Yield the classification of every chunk (a Series of texts) in input order, chunks are only read as workers free up
+        workers = workers or os.cpu_count()
+        start_time = time.perf_counter()
+        classified = 0
+        if workers == 1:
+            self.prepare()
+            for chunk in chunks:
+                classification = self.classify(chunk)
+                classified += len(classification)
+                yield classification
+        else:
+            # Each worker receives the model once, at most two chunks per worker are in flight
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(self,)) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_classify_batch_chunk, chunk))
+                    if len(pending) >= workers * 2:
+                        classification = pending.popleft().result()
+                        classified += len(classification)
+                        yield classification
+                while pending:
+                    classification = pending.popleft().result()
+                    classified += len(classification)
+                    yield classification
+        elapsed = time.perf_counter() - start_time
+
+        print(f'{self.name}: classified {classified} tweets in {elapsed:.2f}s ({classified / elapsed if elapsed else 0:.0f} tweets/s)')
+
     @staticmethod
     def sentiment_score(x):
         if x >= 0.5:
@@ -49,29 +129,146 @@ class SklearnBaseModel(BaseModel):
     """
     Skeleton for Sklearn models
     """
-    def __init__(self, name, classifier, ngram_range=(1,1)):
+    # Whole batches are vectorized at once, and their feature matrices shared with the other models
+    parallel_classify = False
+    # Models pickled before the sparse path existed were trained on dense input
+    _dense = True
+    _batch_size = 1000
+
+    def __init__(self, name, classifier, ngram_range=(1,1), dense=False, batch_size=1000, vectorizer_class=skl.feature_extraction.text.TfidfVectorizer, **vectorizer_params):
         self._classifier = classifier
-        self._vectorizer = skl.feature_extraction.text.TfidfVectorizer(ngram_range=ngram_range, stop_words=skl.feature_extraction.text.ENGLISH_STOP_WORDS)
+        self._vectorizer = vectorizer_class(ngram_range=ngram_range, stop_words=skl.feature_extraction.text.ENGLISH_STOP_WORDS, **vectorizer_params)
+        # Only densify the feature matrix if the classifier cannot take sparse input
+        self._dense = dense
+        # Number of rows converted to a dense array at a time
+        self._batch_size = batch_size
         super().__init__(name)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        vectorizer = self._fitted_vectorizer()
+        vocabulary = getattr(vectorizer, 'vocabulary_', None)
+        if vocabulary is not None:
+            # Store the vocabulary as one array of newline separated terms in feature index order instead of a dict,
+            # joblib can memory-map it and it is only turned back into a dict when the model is first used
+            terms = sorted(vocabulary, key=vocabulary.get)
+            state['_terms'] = np.frombuffer('\n'.join(terms).encode('utf-8'), dtype=np.uint8)
+            vectorizer = copy.copy(vectorizer)
+            del vectorizer.vocabulary_
+            # Only kept for introspection, and as large as the vocabulary
+            vectorizer.__dict__.pop('stop_words_', None)
+            if isinstance(self._vectorizer, CachedVectorizer):
+                state['_vectorizer'] = copy.copy(self._vectorizer)
+                state['_vectorizer'].vectorizer = vectorizer
+            else:
+                state['_vectorizer'] = vectorizer
+        return state
+
+    @staticmethod
+    def set_classifier_params(classifier, params):
+        # Apply the parameters of the classifier, the others are returned for the vectorizer
+        names = classifier.get_params()
+        classifier.set_params(**{name: value for name, value in params.items() if name in names})
+        return {name: value for name, value in params.items() if name not in names}
+
+    @staticmethod
+    def model_name(prefix, ngram_range, classifier, vectorizer_params, vectorizer_class=skl.feature_extraction.text.TfidfVectorizer):
+        # Only parameters that differ from the defaults are named, so default models keep their names
+        defaults = type(classifier)().get_params()
+        params = {name: value for name, value in classifier.get_params().items() if value != defaults[name]}
+        defaults = vectorizer_class().get_params()
+        params.update({name: value for name, value in vectorizer_params.items() if value != defaults.get(name)})
+        return f'{prefix} ngram={ngram_range}' + ''.join(f' {name}={value}' for name, value in sorted(params.items()))
+
+    def prepare(self):
+        self._restore_vocabulary()
+
     def classify(self, x: pd.Series) -> pd.Series:
-        # Retrieve matrix from trained vectorizer
+        self._restore_vocabulary()
+        # Retrieve sparse (CSR) matrix from trained vectorizer
         matrix = self._vectorizer.transform(x)
-        # Flatten the feature matrix into vector (single dimension)
-        vector = matrix.toarray()
         # Make classifications
-        classification = self._classifier.predict(vector)
+        classification = self._predict(matrix)
         # Wrap result into pandas series
         return pd.Series(classification, index=x.index)
 
     def train(self, x: pd.Series, y: pd.Series):
-        # Initialise feature vector
-        self._vectorizer.fit(x)
-        matrix = self._vectorizer.transform(x)
-        # Flatten the feature matrix into vector (single dimension)
-        vector = matrix.toarray()
+        self.__dict__.pop('_terms', None)
+        # Initialise feature vector, the corpus is only tokenized once
+        matrix = self._vectorizer.fit_transform(x)
         # Train the model
-        self._classifier.fit(vector, y)
+        self._fit(matrix, y)
+
+    def use_feature_store(self, store):
+        # Share fitted vocabularies and feature matrices with the other models of the store
+        if isinstance(self._vectorizer, CachedVectorizer):
+            self._vectorizer.store = store
+        else:
+            self._vectorizer = CachedVectorizer(self._vectorizer, store)
+
+    def _fitted_vectorizer(self):
+        return self._vectorizer.vectorizer if isinstance(self._vectorizer, CachedVectorizer) else self._vectorizer
+
+    def _restore_vocabulary(self):
+        terms = self.__dict__.pop('_terms', None)
+        if terms is not None:
+            terms = bytes(terms).decode('utf-8').split('\n')
+            self._fitted_vectorizer().vocabulary_ = dict(zip(terms, range(len(terms))))
+
+    def _predict(self, matrix):
+        if not self._dense:
+            return self._classifier.predict(matrix)
+        # Densify batch by batch so memory stays bounded by batch_size rows
+        return np.concatenate([self._classifier.predict(batch) for _, batch in self._dense_batches(matrix)])
+
+    def _fit(self, matrix, y):
+        if not self._dense:
+            self._classifier.fit(matrix, y)
+        elif hasattr(self._classifier, 'partial_fit'):
+            # Incremental learners can be trained one dense batch at a time
+            y = np.asarray(y)
+            classes = np.unique(y)
+            for start, batch in self._dense_batches(matrix):
+                self._classifier.partial_fit(batch, y[start:start + self._batch_size], classes=classes)
+        else:
+            self._classifier.fit(matrix.toarray(), y)
+
+    def _dense_batches(self, matrix):
+        for start in range(0, matrix.shape[0], self._batch_size):
+            yield start, matrix[start:start + self._batch_size].toarray()
+
+class SklearnStreamingBaseModel(SklearnBaseModel):
+    """
+    Skeleton for Sklearn models trained out of core: texts are hashed into a fixed number of features,
+    so there is no vocabulary to fit or hold, and the classifier learns one minibatch at a time with partial_fit
+    """
+    # Every sentiment the classifier can be given, partial_fit needs them up front
+    classes = np.array([-1, 0, 1])
+    # Models that can be trained from minibatches streamed from the database
+    streaming = True
+
+    def __init__(self, name, classifier, ngram_range=(1,1), epochs=1, train_batch_size=10000, **vectorizer_params):
+        # 2**18 features are plenty for tweets and keep the saved coefficients small
+        vectorizer_params.setdefault('n_features', 2**18)
+        super().__init__(name, classifier, ngram_range=ngram_range, vectorizer_class=skl.feature_extraction.text.HashingVectorizer, **vectorizer_params)
+        self._epochs = epochs
+        self._train_batch_size = train_batch_size
+
+    def use_feature_store(self, store):
+        # Hashing is stateless and cheap, there is nothing worth sharing
+        pass
+
+    def train(self, x: pd.Series, y: pd.Series):
+        # Data already in memory is learnt in the same minibatches as streamed data
+        size = self._train_batch_size
+        self.train_stream(lambda: ((x.iloc[start:start + size], y.iloc[start:start + size]) for start in range(0, len(x), size)))
+
+    def train_stream(self, batches):
+        # batches() returns a new iterator of (texts, sentiments) minibatches for every epoch
+        for _ in range(self._epochs):
+            for x, y in batches():
+                if len(x):
+                    self._classifier.partial_fit(self._vectorizer.transform(x), np.asarray(y), classes=self.classes)
 #endregion
 
 #region vader class
@@ -82,11 +279,23 @@ class VaderModel(BaseModel):
     does not need to be trained
     """
     def __init__(self):
-        self._analyzer = vader.SentimentIntensityAnalyzer()
+        self._engine = VaderEngine()
         super().__init__('VaderMD')
 
+    def __getstate__(self):
+        # Nothing is trained, the lexicon is read from the package again instead of being pickled
+        state = self.__dict__.copy()
+        state['_engine'] = None
+        return state
+
+    def prepare(self):
+        if self._engine is None:
+            self._engine = VaderEngine()
+
     def classify(self, x: pd.Series) -> pd.Series:
-        classification = x.apply(lambda x: BaseModel.sentiment_score(self._analyzer.polarity_scores(x)['compound']))
+        self.prepare()
+        # Compound scores of the whole batch at once, the same as SentimentIntensityAnalyzer.polarity_scores
+        classification = self._engine.compound(x).apply(BaseModel.sentiment_score)
         return classification
  
 #endregion
@@ -111,10 +320,19 @@ class TextBlobDefaultNBA(TextBlobBaseModel):
     """
     def __init__(self):
         self._analyzer = tb.sentiments.NaiveBayesAnalyzer()
+        self._trained = False
         super().__init__('TextBlobDefNBA')
 
     def train(self, x: pd.Series, y: pd.Series):
-        self._analyzer.train()
+        # Trained on the movie review corpus, not on our data, so it never has to be trained twice
+        self.prepare()
+
+    def prepare(self):
+        # The analyzer trains on the movie review corpus on first use, do it before the first chunk
+        # Models saved before the flag existed are trained again once
+        if not getattr(self, '_trained', False):
+            self._analyzer.train()
+            self._trained = True
 
     def _classify(self, x):
         sentiment = self._analyzer.analyze(x)
@@ -142,24 +360,116 @@ class TextBlobNBC(TextBlobBaseModel):
         prob_dist = self._classifier.prob_classify(x)
         return prob_dist.max()
 
+class TextBlobCompiledNBC(BaseModel):
+    """
+    The word presence Naive Bayes of TextBlobNBC (NLTK's expected likelihood estimates, tokens of TextBlob),
+    with the same predictions. Its likelihoods are NumPy arrays over an integer vocabulary,
+    whole batches are classified with one sparse matrix product instead of one feature dict per tweet
+    """
+    def __init__(self):
+        super().__init__('TextBlobNBC')
+
+    @staticmethod
+    def _tokenize(texts):
+        # Words of TextBlob's basic_extractor, one tokenization per tweet
+        return [list(tb.tokenizers.word_tokenize(text, include_punc=False)) for text in texts]
+
+    def _presence(self, documents):
+        # Binary (documents x vocabulary) matrix of the vocabulary words each document contains,
+        # whose tokens are compared without the punctuation around them, like TextBlob does
+        indices = []
+        indptr = [0]
+        for words in documents:
+            present = {self._vocabulary.get(tb.utils.strip_punc(word, all=False)) for word in words}
+            present.discard(None)
+            indices.extend(present)
+            indptr.append(len(indices))
+        return scipy.sparse.csr_matrix((np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)), shape=(len(documents), len(self._vocabulary)))
+
+    def train(self, x: pd.Series, y: pd.Series):
+        documents = self._tokenize(x)
+        self._vocabulary = {}
+        for words in documents:
+            for word in words:
+                self._vocabulary.setdefault(word, len(self._vocabulary))
+
+        self._classes, labels = np.unique(np.asarray(y), return_inverse=True)
+        documents_per_class = np.bincount(labels, minlength=len(self._classes)).astype(float)
+        membership = scipy.sparse.csr_matrix((np.ones(len(labels)), (labels, np.arange(len(labels)))), shape=(len(self._classes), len(labels)))
+        # Documents of each class containing each word
+        present = np.asarray((membership @ self._presence(documents)).todense())
+        absent = documents_per_class[:, None] - present
+
+        # Expected likelihood estimates (add 0.5), over the values a word took in training: True, False or both
+        total = present.sum(axis=0)
+        values = 1 + ((total > 0) & (total < len(labels)))
+        divisor = documents_per_class[:, None] + 0.5 * values
+        log_present = np.log2((present + 0.5) / divisor)
+        log_absent = np.log2((absent + 0.5) / divisor)
+        log_prior = np.log2((documents_per_class + 0.5) / (len(labels) + 0.5 * len(self._classes)))
+
+        # Every word is absent to start with, the words of a tweet swap their absent likelihood for the present one
+        self._bias = log_prior + log_absent.sum(axis=1)
+        self._weights = (log_present - log_absent).T
+
+    def classify(self, x: pd.Series) -> pd.Series:
+        scores = self._presence(self._tokenize(x)) @ self._weights + self._bias
+        # Classes in reverse so ties go to the largest label, like NLTK's ProbDist.max
+        best = scores[:, ::-1].argmax(axis=1)
+        return pd.Series(self._classes[::-1][best], index=x.index)
+
 #endregion
 
 #region self-built model
 class SklearnNBMD(SklearnBaseModel):
     """
     This class use Sklearn library to build a Naive Bayse, Tfidf vectorizer sentiment analysis model,
-    the model is trained with our own data
+    the model is trained with our own data. MultinomialNB works directly on the sparse Tfidf matrix.
+    Other parameters go to MultinomialNB (e.g. alpha) or TfidfVectorizer (e.g. min_df)
     """
-    def __init__(self, ngram_range:tuple=(1,1)):
-        classifier = skl.naive_bayes.GaussianNB()
-        super().__init__(f'SklearnNB ngram={ngram_range}', classifier, ngram_range = ngram_range)
+    def __init__(self, ngram_range:tuple=(1,1), **params):
+        classifier = skl.naive_bayes.MultinomialNB()
+        vectorizer_params = self.set_classifier_params(classifier, params)
+        name = self.model_name('SklearnNB', ngram_range, classifier, vectorizer_params)
+        super().__init__(name, classifier, ngram_range = ngram_range, **vectorizer_params)
      
 class SklearnSVM(SklearnBaseModel):
     """
     This class use Sklearn library to build a Support Vector Machine sentiment analysis model,
-    the model is trained with our own data
+    the model is trained with our own data.
+    Other parameters go to SVC (e.g. C, kernel) or TfidfVectorizer (e.g. min_df)
     """
-    def __init__(self, ngram_range:tuple=(1,1)):
+    def __init__(self, ngram_range:tuple=(1,1), **params):
         classifier = skl.svm.SVC()
-        super().__init__(f'SklearnSVM ngram={ngram_range}', classifier, ngram_range = ngram_range)
+        vectorizer_params = self.set_classifier_params(classifier, params)
+        name = self.model_name('SklearnSVM', ngram_range, classifier, vectorizer_params)
+        super().__init__(name, classifier, ngram_range = ngram_range, **vectorizer_params)
+
+class SklearnSGD(SklearnStreamingBaseModel):
+    """
+    This class use Sklearn library to build a linear Support Vector Machine trained by stochastic gradient descent
+    on hashed features, the training time grows linearly with the number of tweets.
+    Other parameters go to SGDClassifier (e.g. alpha) or HashingVectorizer (e.g. n_features)
+    """
+    def __init__(self, ngram_range:tuple=(1,1), epochs=5, **params):
+        classifier = skl.linear_model.SGDClassifier()
+        vectorizer_params = self.set_classifier_params(classifier, params)
+        name = self.model_name('SklearnSGD', ngram_range, classifier, vectorizer_params, skl.feature_extraction.text.HashingVectorizer)
+        # Seeded after naming, the same shuffling on every run
+        if 'random_state' not in params:
+            classifier.set_params(random_state=0)
+        super().__init__(name, classifier, ngram_range = ngram_range, epochs = epochs, alternate_sign = False, **vectorizer_params)
+
+class SklearnStreamNB(SklearnStreamingBaseModel):
+    """
+    This class use Sklearn library to build a multinomial Naive Bayes model on hashed term counts,
+    one pass over the data gives the same counts however it is split into minibatches.
+    Other parameters go to MultinomialNB (e.g. alpha) or HashingVectorizer (e.g. n_features)
+    """
+    def __init__(self, ngram_range:tuple=(1,1), **params):
+        classifier = skl.naive_bayes.MultinomialNB()
+        vectorizer_params = self.set_classifier_params(classifier, params)
+        name = self.model_name('SklearnStreamNB', ngram_range, classifier, vectorizer_params, skl.feature_extraction.text.HashingVectorizer)
+        # Term counts, multinomial NB needs non-negative features
+        super().__init__(name, classifier, ngram_range = ngram_range, alternate_sign = False, norm = None, **vectorizer_params)
 #endregion
\ No newline at end of file
@@ -0,0 +1,354 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import sklearn
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    # Not available on Windows
+    import resource
+except ImportError:
+    resource = None
+
+import db_manager
+import data_analyzer
+import dashboard_snapshot
+import data_visualisation
+import result_store
+import tweet_reviews
+import tweet_scoring
+from load_test import callback_payload
+
+# Benchmark of the whole pipeline (ingest -> train -> analyze -> serve) on synthetic tweet corpora.
+#   python benchmark.py run --sizes 10000 100000 --output results.json
+#   python benchmark.py compare baseline.json results.json
+# Every size runs in its own scratch database, the results are written as JSON so runs can be compared
+
+repository_path = os.path.dirname(os.path.abspath(__file__))
+
+class PeakMemory:
+    """
+    Peak resident memory of the process while a block runs, sampled with psutil.
+    Without psutil the peak of the process so far is reported, which never goes down between stages
+    """
+    source = 'psutil' if psutil else 'ru_maxrss' if resource else None
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if psutil:
+            process = psutil.Process()
+            self.peak = process.memory_info().rss
+            self._thread = threading.Thread(target=self._sample, args=(process,), daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+        elif resource:
+            # Kilobytes on Linux, bytes on macOS
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    def _sample(self, process):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, process.memory_info().rss)
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 2**20, 1) if self.source else None
+
+class StageRecorder:
+    """
+    Times the stages of one corpus size, each stage is a dict of the results.
+    Blocks may set 'seconds' themselves to leave out work that is not part of the stage (e.g. generating data)
+    """
+    def __init__(self, size, results):
+        self.size = size
+        self.results = results
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        entry = {'size': self.size, 'stage': name, 'rows': rows}
+        gc.collect()
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            try:
+                yield entry
+            except Exception as err:
+                # A failing stage (e.g. a model missing its corpora) is recorded, the next stages still run
+                entry['error'] = f'{type(err).__name__}: {err}'
+            elapsed = time.perf_counter() - start
+        entry.setdefault('seconds', elapsed)
+        entry['seconds'] = round(entry['seconds'], 6)
+        if entry['rows'] and entry['seconds']:
+            entry['rows_per_second'] = round(entry['rows'] / entry['seconds'], 1)
+        entry['peak_rss_mb'] = memory.peak_mb
+        self.results.append(entry)
+
+        if 'error' in entry:
+            status = entry['error']
+        else:
+            status = f'{entry["seconds"]:10.3f}s' + (f'  {entry["rows_per_second"]:12.0f} rows/s' if 'rows_per_second' in entry else '')
+        print(f'[{self.size}] {name:44} {status}  {entry["peak_rss_mb"]} MB')
+
+class CorpusGenerator:
+    """
+    Synthetic tweets seeded from the tweets of reviewed_data.csv: each one is a random seed tweet
+    with a few words of the whole corpus inserted at a random position, so the vocabulary keeps growing
+    with the corpus like real tweets do. A synthetic tweet has the rating of its seed tweet
+    """
+    def __init__(self, path, seed, extra_words=4):
+        df = pd.read_csv(path, dtype=str, encoding='utf-8-sig', usecols=['text', 'rate']).dropna(subset=['text'])
+        self.words = [text.split() for text in df['text']]
+        self.vocabulary = sorted({word for words in self.words for word in words})
+        self.rates = df['rate'].fillna('').tolist()
+        self.extra_words = extra_words
+        self.seed = seed
+
+    def chunks(self, count, chunk_size, start_id):
+        # (ids, texts, seed tweet indices) of count tweets, chunk_size at a time.
+        # A corpus only depends on the seed and its size, not on the sizes generated before
+        rng = np.random.default_rng([self.seed, count])
+        for offset in range(0, count, chunk_size):
+            size = min(chunk_size, count - offset)
+            seeds = rng.integers(len(self.words), size=size)
+            extra = rng.integers(len(self.vocabulary), size=(size, self.extra_words)).tolist()
+            positions = rng.random(size).tolist()
+            texts = []
+            for seed, words, position in zip(seeds.tolist(), extra, positions):
+                base = self.words[seed]
+                split = int(position * (len(base) + 1))
+                texts.append(' '.join(base[:split] + [self.vocabulary[word] for word in words] + base[split:]))
+            yield np.arange(start_id + offset, start_id + offset + size), texts, seeds
+
+def make_tweets(ids, texts, start):
+    # Objects with the attributes of the tweepy statuses stored by db_manager.add_tweets
+    return [
+        SimpleNamespace(
+            id=tweet_id,
+            user=SimpleNamespace(id=tweet_id % 50000),
+            in_reply_to_status_id=None,
+            full_text=text,
+            created_at=str(start + datetime.timedelta(seconds=tweet_id % 604800)),
+            place=None,
+            favorite_count=0,
+            retweet_count=0)
+        for tweet_id, text in zip(ids.tolist(), texts)
+    ]
+
+def get_meta(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repository_path, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'started_at': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'rss_source': PeakMemory.source,
+        'seed': args.seed,
+        'arguments': vars(args),
+    }
+
+def benchmark_size(size, args, corpus, results):
+    recorder = StageRecorder(size, results)
+    reviewed = min(int(size * args.reviewed), args.max_reviewed)
+    start_id = 1380000000000000000
+
+    # Fresh database, models and snapshot for every size
+    directory = os.path.join(args.workdir, f'size_{size}')
+    os.makedirs(os.path.join(directory, 'db'))
+    os.chdir(directory)
+    db_manager.close()
+    db_manager.db_path = os.path.join(directory, 'db', 'database.db')
+    db_manager.init()
+
+    # Ingest, only the inserts are timed
+    start = datetime.datetime(2021, 4, 1)
+    seeds = []
+    with recorder.stage('add_tweets', rows=size) as entry:
+        entry['seconds'] = 0
+        for ids, texts, chunk_seeds in corpus.chunks(size, args.batch_size, start_id):
+            if len(seeds) * args.batch_size < reviewed:
+                seeds.append(chunk_seeds)
+            tweets = make_tweets(ids, texts, start)
+            insert_start = time.perf_counter()
+            db_manager.add_tweets(tweets)
+            entry['seconds'] += time.perf_counter() - insert_start
+
+    # The first tweets are reviewed, with the rating of their seed tweet
+    seeds = np.concatenate(seeds)[:reviewed]
+    reviews = pd.DataFrame({'id': np.arange(start_id, start_id + reviewed), 'rate': [corpus.rates[seed] for seed in seeds.tolist()]})
+    reviews.to_csv('reviewed_data.csv', index=False)
+    # The generated ids are intact, every one maps to itself
+    reviews[['id']].assign(id_original=reviews['id']).to_csv(tweet_reviews.id_map_path, index=False)
+    with recorder.stage('import_csv', rows=reviewed):
+        tweet_reviews.import_csv('reviewed_data.csv')
+
+    with recorder.stage('get_dataset', rows=reviewed) as entry:
+        x_train, x_test, y_train, y_test = data_analyzer.get_dataset(args.seed)
+        entry['rows'] = len(x_train) + len(x_test)
+    with recorder.stage('get_dataset_cached', rows=reviewed) as entry:
+        data_analyzer.get_dataset(args.seed)
+        entry['rows'] = len(x_train) + len(x_test)
+
+    trained = []
+    if 'models' not in args.skip:
+        for model in data_analyzer.get_models():
+            if args.models and model.name not in args.models:
+                continue
+            with recorder.stage(f'train:{model.name}', rows=len(x_train)) as entry:
+                model.train(x_train, y_train)
+            if 'error' in entry:
+                continue
+            # Both splits are classified, like the analysis does
+            with recorder.stage(f'classify:{model.name}', rows=len(x_train) + len(x_test)) as entry:
+                classification = {'train': model.classify(x_train), 'test': model.classify(x_test)}
+            if 'error' in entry:
+                continue
+
+            model_id = db_manager.add_analysis_model(model.name)
+            sentiment = {'train': y_train, 'test': y_test}
+            with recorder.stage(f'write_results:{model.name}', rows=len(x_train) + len(x_test)):
+                for label in classification:
+                    result_store.write_results(model_id, label, classification[label], sentiment[label])
+            for label in classification:
+                db_manager.add_classification_counts(model_id, data_analyzer.count_classification(label, sentiment[label].reindex(classification[label].index), classification[label]))
+                data_analyzer.update_performance(model_id, label)
+            data_analyzer.save_model(model, model_id)
+            trained.append(model.name)
+
+    with recorder.stage('write_snapshot'):
+        dashboard_snapshot.write_snapshot()
+
+    if 'dashboard' not in args.skip and trained:
+        with recorder.stage('create_app') as entry:
+            # Figures are built by the callbacks below instead of a warming thread
+            app = data_visualisation.create_app(warm=False)
+        if 'error' not in entry:
+            client = app.server.test_client()
+            values = range(len(trained) * 2)
+            # First request of every model builds its figures, the second one is a cache hit
+            for name in ('callback_cold', 'callback_warm'):
+                with recorder.stage(name, rows=len(values)) as entry:
+                    latencies = []
+                    for value in values:
+                        request_start = time.perf_counter()
+                        response = client.post('/_dash-update-component', json=callback_payload(value))
+                        latencies.append(time.perf_counter() - request_start)
+                        if response.status_code != 200:
+                            raise RuntimeError(f'Callback returned HTTP {response.status_code}')
+                    entry['p50_ms'] = round(np.percentile(latencies, 50) * 1000, 3)
+                    entry['p99_ms'] = round(np.percentile(latencies, 99) * 1000, 3)
+
+    if 'scoring' not in args.skip and trained:
+        with recorder.stage('score_tweets', rows=size):
+            tweet_scoring.score_tweets(trained, chunk_size=args.batch_size, workers=1)
+
+    db_manager.close()
+    os.chdir(repository_path)
+
+def run(args):
+    created = args.workdir is None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='benchmark_'))
+    corpus = CorpusGenerator(os.path.abspath(args.corpus), args.seed)
+    output = {'meta': get_meta(args), 'results': []}
+
+    try:
+        for size in args.sizes:
+            benchmark_size(size, args, corpus, output['results'])
+            # Written after every size, so the results of a long run are kept if it is interrupted
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(output, f, indent=2)
+    finally:
+        os.chdir(repository_path)
+        if created and not args.keep:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    print(f'Results written to {args.output}')
+
+def compare(args):
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = {(entry['size'], entry['stage']): entry for entry in json.load(f)['results']}
+    with open(args.results, 'r', encoding='utf-8') as f:
+        results = json.load(f)['results']
+
+    regressions = []
+    print(f'{"size":>9} {"stage":44} {"baseline":>10} {"current":>10} {"ratio":>7} {"rss ratio":>9}')
+    for entry in results:
+        old = baseline.get((entry['size'], entry['stage']))
+        if old is None or 'error' in old or 'error' in entry:
+            continue
+        ratio = entry['seconds'] / old['seconds'] if old['seconds'] else 1
+        rss_ratio = entry['peak_rss_mb'] / old['peak_rss_mb'] if entry['peak_rss_mb'] and old['peak_rss_mb'] else 1
+
+        flags = []
+        # Stages shorter than min_seconds are mostly noise
+        if ratio > 1 + args.threshold and entry['seconds'] >= args.min_seconds:
+            flags.append('slower')
+        if rss_ratio > 1 + args.threshold:
+            flags.append('more memory')
+        if flags:
+            regressions.append(entry)
+        print(f'{entry["size"]:>9} {entry["stage"]:44} {old["seconds"]:>9.3f}s {entry["seconds"]:>9.3f}s {ratio:>7.2f} {rss_ratio:>9.2f}  {", ".join(flags)}')
+
+    print(f'{len(regressions)} regressions above {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmark')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help='Numbers of tweets of the synthetic corpora (10k to 10M)')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the corpora and of the train/test split')
+    run_parser.add_argument('--corpus', default='reviewed_data.csv', help='Tweets the synthetic corpora are built from')
+    run_parser.add_argument('--reviewed', type=float, default=0.2, help='Fraction of the tweets that are reviewed')
+    run_parser.add_argument('--max-reviewed', type=int, default=50000, help='Maximum number of reviewed tweets, which the models train and classify')
+    run_parser.add_argument('--models', nargs='*', metavar='MODEL', help='Models to benchmark (all by default)')
+    run_parser.add_argument('--skip', nargs='*', default=[], choices=['models', 'dashboard', 'scoring'], help='Stages to leave out')
+    run_parser.add_argument('--batch-size', type=int, default=10000, help='Tweets inserted and scored at a time')
+    run_parser.add_argument('--workdir', help='Directory of the scratch databases (a temporary directory by default)')
+    run_parser.add_argument('--keep', action='store_true', help='Keep the temporary scratch directory')
+    run_parser.add_argument('--output', default='benchmark_results.json', help='JSON file the results are written to')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files, exits with 1 on regressions')
+    compare_parser.add_argument('baseline', help='Results of the reference run')
+    compare_parser.add_argument('results', help='Results of the run to check')
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown or memory growth reported as a regression')
+    compare_parser.add_argument('--min-seconds', type=float, default=0.05, help='Shorter stages are not checked for slowdowns')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        args.output = os.path.abspath(args.output)
+        run(args)
+    else:
+        sys.exit(compare(args))
@@ -0,0 +1,60 @@
+import os
+import re
+import time
+import tempfile
+import argparse
+import pandas as pd
+
+import db_manager
+import text_cleaner
+
+# Compares text_cleaner with the per-row cleaning it replaced, on the tweets of reviewed_data.csv
+
+def legacy_clean_text(tweet):
+    # data_analyzer.clean_text before the text_cleaner module
+    tweet = re.sub(r'@[A-Za-z0-9]+', '',tweet)
+    tweet = re.sub(r'#', '', tweet)
+    tweet = re.sub(r'RT[\s]+', '', tweet)
+    tweet = re.sub(r'https?:\/\/\S+', '',tweet)
+    return tweet
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='reviewed_data.csv', help='CSV file with a text column')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, the fastest is reported')
+
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.path, dtype=str, encoding='utf-8-sig', usecols=['text']).dropna()
+    df.index = pd.RangeIndex(len(df), name='id')
+    texts = df['text']
+
+    legacy_time, legacy = best_time(lambda: df.apply(lambda x: legacy_clean_text(x['text']), axis=1), args.repeat)
+    series_time, cleaned = best_time(lambda: text_cleaner.clean_series(texts), args.repeat)
+
+    # Cache in a scratch database: the first run cleans and stores every tweet, later runs only read them back
+    with tempfile.TemporaryDirectory() as directory:
+        db_manager.db_path = os.path.join(directory, 'benchmark.db')
+        db_manager.init()
+        store_time, _ = best_time(lambda: text_cleaner.clean_tweets(texts), 1)
+        cached_time, cached = best_time(lambda: text_cleaner.clean_tweets(texts), args.repeat)
+        db_manager.close()
+
+    print(f'{len(texts)} tweets from {args.path}')
+    for name, seconds in [
+        ('legacy df.apply(clean_text, axis=1)', legacy_time),
+        ('clean_series (single compiled pattern)', series_time),
+        ('clean_tweets, first run (clean + store)', store_time),
+        ('clean_tweets, cached', cached_time),
+    ]:
+        print(f'{name:42} {seconds * 1000:9.2f} ms  {len(texts) / seconds:12.0f} tweets/s  {legacy_time / seconds:6.1f}x')
+
+    print(f'Tweets cleaned differently from the legacy function: {(legacy != cleaned).sum()} (series), {(legacy != cached).sum()} (cached)')
@@ -0,0 +1,54 @@
+import sys
+import time
+import argparse
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from analysis_model import TextBlobNBC, TextBlobCompiledNBC
+from text_cleaner import clean_series
+from tweet_reviews import rate_scores
+
+# Checks that TextBlobCompiledNBC classifies tweets like the TextBlob NaiveBayesClassifier of TextBlobNBC,
+# trained on the same tweets of reviewed_data.csv, and compares the time both take. Exits with an error if they disagree.
+# TextBlobNBC gets slow past a few thousand tweets, --limit keeps the run short
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='reviewed_data.csv', help='CSV file with text and rate columns')
+    parser.add_argument('--limit', type=int, default=1000, help='Number of reviewed tweets used, split in half for training and testing')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the train/test split')
+
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.path, dtype=str, encoding='utf-8-sig', usecols=['text', 'rate'])
+    df['sentiment'] = df['rate'].str.lower().map(rate_scores)
+    df = df.dropna(subset=['text', 'sentiment']).head(args.limit)
+    # Tweets are cleaned before they are classified
+    x_train, x_test, y_train, y_test = train_test_split(clean_series(df['text']), df['sentiment'].astype(int), train_size=0.5, random_state=args.seed)
+
+    rows = []
+    classification = {}
+    for model in (TextBlobNBC(), TextBlobCompiledNBC()):
+        train_time, _ = timed(lambda: model.train(x_train, y_train))
+        classify_time, classification[type(model).__name__] = timed(lambda: pd.concat([model.classify(x_train), model.classify(x_test)]))
+        rows.append((type(model).__name__, train_time, classify_time))
+
+    print(f'{len(x_train)} training and {len(x_test)} testing tweets from {args.path}')
+    legacy_total = rows[0][1] + rows[0][2]
+    for name, train_time, classify_time in rows:
+        print(f'{name:20} train {train_time * 1000:10.2f} ms  classify {classify_time * 1000:10.2f} ms  {legacy_total / (train_time + classify_time):7.1f}x')
+
+    legacy, compiled = classification['TextBlobNBC'], classification['TextBlobCompiledNBC']
+    different = legacy.astype(int) != compiled.astype(int)
+    accuracy = (compiled.loc[x_test.index].astype(int) == y_test).mean()
+    print(f'Tweets classified differently: {different.sum()} of {len(different)}, test accuracy {accuracy:.4f}')
+    for index in different[different].index[:10]:
+        print(f'  {legacy[index]:>3} {compiled[index]:>3}  {x_train.get(index, x_test.get(index))[:100]!r}')
+
+    if different.any():
+        sys.exit(1)
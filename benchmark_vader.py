@@ -0,0 +1,62 @@
+import sys
+import time
+import argparse
+import pandas as pd
+import vaderSentiment.vaderSentiment as vader
+
+from analysis_model import BaseModel, VaderModel
+from text_cleaner import clean_series
+from vader_engine import VaderEngine
+
+# Checks that VaderModel scores tweets like SentimentIntensityAnalyzer.polarity_scores, one tweet at a time, which it replaced,
+# and compares their throughput on the tweets of reviewed_data.csv. Exits with an error if they disagree
+
+def legacy_compound(analyzer, texts):
+    # VaderModel.classify before the vader_engine module, without the classification
+    return texts.apply(lambda x: analyzer.polarity_scores(x)['compound'])
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='reviewed_data.csv', help='CSV file with a text column')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest is reported')
+    parser.add_argument('--copies', type=int, default=1, help='Score the tweets this many times over, for larger batches')
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='Largest difference allowed between compound scores')
+
+    args = parser.parse_args()
+
+    texts = pd.read_csv(args.path, dtype=str, encoding='utf-8-sig', usecols=['text'])['text'].dropna()
+    # Tweets are cleaned before they are classified
+    texts = clean_series(pd.concat([texts] * args.copies, ignore_index=True))
+
+    analyzer = vader.SentimentIntensityAnalyzer()
+    engine = VaderEngine()
+    model = VaderModel()
+
+    legacy_time, legacy = best_time(lambda: legacy_compound(analyzer, texts), args.repeat)
+    engine_time, compound = best_time(lambda: engine.compound(texts), args.repeat)
+    model_time, classification = best_time(lambda: model.classify(texts), args.repeat)
+
+    print(f'{len(texts)} tweets from {args.path}')
+    for name, seconds in [
+        ('polarity_scores per tweet', legacy_time),
+        ('VaderEngine.compound', engine_time),
+        ('VaderModel.classify', model_time),
+    ]:
+        print(f'{name:28} {seconds * 1000:9.2f} ms  {len(texts) / seconds:12.0f} tweets/s  {legacy_time / seconds:6.1f}x')
+
+    difference = (legacy - compound).abs()
+    labels = (legacy.apply(BaseModel.sentiment_score) != classification).sum()
+    print(f'Largest compound difference: {difference.max():.6f}, tweets over {args.tolerance}: {(difference > args.tolerance).sum()}, classified differently: {labels}')
+    for index in difference[difference > args.tolerance].index[:10]:
+        print(f'  {legacy[index]:8.4f} {compound[index]:8.4f}  {texts[index][:100]!r}')
+
+    if (difference > args.tolerance).any() or labels:
+        sys.exit(1)
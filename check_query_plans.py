@@ -0,0 +1,15 @@
+import sys
+import db_manager
+
+# Fails (exit code 1) if a hot query in db_manager.hot_queries scans a table it should search with an index
+if __name__ == '__main__':
+    failures = db_manager.check_query_plans()
+
+    for name, detail in failures:
+        print(f'{name}: {detail}')
+
+    if failures:
+        print(f'{len(failures)} query plan(s) fall back to a full table scan')
+        sys.exit(1)
+
+    print(f'All {len(db_manager.hot_queries)} hot queries use an index')
@@ -0,0 +1,127 @@
+import os
+import json
+import shutil
+import datetime
+import numpy as np
+import pandas as pd
+
+import db_manager
+import result_store
+
+snapshot_path = './snapshot'
+
+# Bumped whenever the layout of the snapshot files changes
+snapshot_version = 1
+
+performance_columns = ['model_id', 'label', 'accuracy', 'precision', 'recall', 'f1']
+
+
+class Snapshot:
+    """
+    Read-only view of the analysis results used by the dashboard.
+    Classifications of every model and label are stored back to back in memory-mapped arrays,
+    aligned with the manually reviewed sentiment of the same tweets
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.version = meta['version']
+        self.run_id = meta['run_id']
+        self.created_at = meta['created_at']
+        self.performance = pd.DataFrame(meta['performance'], columns=performance_columns + ['model_name', 'start', 'stop'])
+
+        self.ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r')
+        self.classification = np.load(os.path.join(directory, 'classification.npy'), mmap_mode='r')
+        self.sentiment = np.load(os.path.join(directory, 'sentiment.npy'), mmap_mode='r')
+
+        # (model_id, label) -> slice of the arrays
+        self._slices = {(row.model_id, row.label): slice(row.start, row.stop) for row in self.performance.itertuples()}
+
+    def get_performance_df(self):
+        return self.performance.drop(columns=['start', 'stop'])
+
+    def get_classification_df(self, model_id, label):
+        rows = self._slices.get((model_id, label))
+        if rows is None or rows.start == rows.stop:
+            return None
+        return pd.DataFrame({
+            'classification': self.classification[rows],
+            'sentiment': self.sentiment[rows]
+        }, index=pd.Index(self.ids[rows], name='id'))
+
+
+def write_snapshot(path=snapshot_path, run_id=None):
+    if run_id is None:
+        run_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+    performance = db_manager.get_all_classification_performance()
+    if not performance:
+        print('No performance data found, dashboard snapshot not written')
+        return None
+
+    df = pd.DataFrame(performance, columns=performance_columns)
+    names = {model_id: name for model_id, name, _ in db_manager.get_analysis_models() or []}
+    df['model_name'] = df['model_id'].map(names)
+
+    # Ground truth of the reviewed tweets, irrelevant tweets have no sentiment
+    review = db_manager.get_manually_reviewed_tweets() or []
+    sentiment = pd.DataFrame(review, columns=['id', 'text', 'sentiment']).set_index('id')['sentiment'].dropna()
+
+    ids, classifications, sentiments, starts, stops = [], [], [], [], []
+    offset = 0
+    for model_id, label in df[['model_id', 'label']].itertuples(index=False):
+        classification = result_store.read_classification(model_id, label)
+        classification = classification.to_frame() if classification is not None else pd.DataFrame({'classification': []}, index=pd.Index([], name='id'))
+        aligned = classification.join(sentiment, how='inner').dropna()
+        ids.append(aligned.index.to_numpy(dtype='int64'))
+        classifications.append(aligned['classification'].to_numpy(dtype='int8'))
+        sentiments.append(aligned['sentiment'].to_numpy(dtype='int8'))
+        starts.append(offset)
+        offset += len(aligned)
+        stops.append(offset)
+    df['start'] = starts
+    df['stop'] = stops
+
+    # Write into a new directory and switch the CURRENT pointer once complete
+    os.makedirs(path, exist_ok=True)
+    directory = os.path.join(path, run_id)
+    os.mkdir(directory)
+    np.save(os.path.join(directory, 'ids.npy'), np.concatenate(ids) if ids else np.empty(0, dtype='int64'))
+    np.save(os.path.join(directory, 'classification.npy'), np.concatenate(classifications) if ids else np.empty(0, dtype='int8'))
+    np.save(os.path.join(directory, 'sentiment.npy'), np.concatenate(sentiments) if ids else np.empty(0, dtype='int8'))
+    meta = {
+        'version': snapshot_version,
+        'run_id': run_id,
+        'created_at': datetime.datetime.now().isoformat(),
+        'performance': df.astype(object).where(df.notna(), None).to_dict(orient='records'),
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    pointer = os.path.join(path, 'CURRENT')
+    with open(f'{pointer}.tmp', 'w', encoding='utf-8') as f:
+        f.write(run_id)
+    os.replace(f'{pointer}.tmp', pointer)
+
+    # Remove older snapshots, files still mapped by a running dashboard may fail to delete on Windows
+    for name in os.listdir(path):
+        if name != run_id and os.path.isdir(os.path.join(path, name)):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    print(f'Dashboard snapshot {run_id} written to {directory}')
+    return run_id
+
+
+def load_snapshot(path=snapshot_path):
+    try:
+        with open(os.path.join(path, 'CURRENT'), 'r', encoding='utf-8') as f:
+            run_id = f.read().strip()
+        snapshot = Snapshot(os.path.join(path, run_id))
+    except (OSError, ValueError, KeyError) as err:
+        print(f'Failed to load dashboard snapshot: {err}')
+        return None
+
+    if snapshot.version != snapshot_version:
+        print(f'Dashboard snapshot version {snapshot.version} is not supported, expected {snapshot_version}')
+        return None
+    return snapshot
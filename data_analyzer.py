@@ -1,18 +1,38 @@
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report
-from analysis_model import VaderModel, TextBlobDefaultPA, TextBlobDefaultNBA, TextBlobNBC, SklearnNBMD, SklearnSVM
+from analysis_model import VaderModel, TextBlobDefaultPA, TextBlobDefaultNBA, TextBlobCompiledNBC, SklearnNBMD, SklearnSVM, SklearnSGD, SklearnStreamNB
+from feature_store import FeatureStore
+from model_registry import ModelRegistry
+from text_cleaner import clean_tweets, clean_series
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import db_manager
+import dashboard_snapshot
+import metrics
+import result_store
 import os.path
+import time
+import json
+import hashlib
 import joblib
-import re
+import numpy as np
 import pandas as pd
 
 trained_model_path = './trained_models'
+# Directory where shared feature matrices are persisted, None keeps them in memory only
+feature_store_path = './features'
+# Feature store entries unused for this many seconds are deleted after each analysis, then the oldest ones past the size in bytes
+feature_store_max_age = 30 * 24 * 3600
+feature_store_max_size = 2 * 1024 ** 3
+# Seed of the train/test split, every analysis splits the reviewed tweets the same way
+split_seed = 0
+# Parameters chosen by model_selection.py, models with them are analysed along with the default ones
+selected_params_path = './selected_params.json'
 
-def sentiment_analysis(retrain=False):
+def sentiment_analysis(retrain=False, workers=1, incremental=False):
 
     models = []
+    model_paths = []
     models_trained = False
 
     if not retrain:
@@ -20,56 +40,226 @@ def sentiment_analysis(retrain=False):
         trained_models = db_manager.get_analysis_models()
         if trained_models:
             models_trained = True
-            for _, _, model_path in trained_models:
-                try:
-                    with open(f'{model_path}', 'rb') as f:
-                        model = joblib.load(f)
-                        models.append(model)
-                except Exception as err:
-                    print(f'Failed to load model: {err}')
+            # Models are only loaded when they are used
+            registry = ModelRegistry.from_database()
+
+            if incremental:
+                if registry.available():
+                    # Only score what changed since the stored results
+                    incremental_analysis(registry, trained_models)
+                    dashboard_snapshot.write_snapshot()
+                    result_store.prune_results()
+                    return
+                print('Not every trained model could be found, running a full analysis')
+
+            for _, name, model_path in trained_models:
+                model = registry.get(name)
+                if model is not None:
+                    models.append(model)
+                    model_paths.append(model_path)
+    elif incremental:
+        print('Models are re-trained, running a full analysis')
 
     if not models:
-        models = [
-            VaderModel(),
-            TextBlobDefaultPA(),
-            TextBlobDefaultNBA(),
-            TextBlobNBC(),
-            SklearnNBMD(),
-            SklearnNBMD(ngram_range=(1,2)),
-            SklearnSVM(),
-            SklearnSVM(ngram_range=(1,2))
-        ]
+        models = get_models()
         models_trained = False
 
+    # Share vectorizers and feature matrices between models
+    feature_store = FeatureStore(feature_store_path)
+    for model in models:
+        model.use_feature_store(feature_store)
+
     # Clear previous analysis history
     db_manager.clear_analysis_tables()
     
     # Split datasets
     x_train, x_test, y_train, y_test = get_dataset()
 
+    # Add model ids up front so they follow the model order regardless of which model finishes first
+    with db_manager.transaction():
+        model_ids = [db_manager.add_analysis_model(model.name) for model in models]
+        if models_trained:
+            # Keep pointing at the loaded files, so the next run can load them again
+            for model_id, path in zip(model_ids, model_paths):
+                db_manager.update_analysis_model_path(model_id, path)
+                db_manager.update_analysis_model_version(model_id, model_version(path))
+
+    if not workers:
+        workers = os.cpu_count()
+
+    if workers > 1:
+        # Models that classify one tweet at a time spread their chunks over all the workers, one model after the other
+        chunked = [(model, model_id) for model, model_id in zip(models, model_ids) if model.parallel_classify]
+        pooled = [(model, model_id) for model, model_id in zip(models, model_ids) if not model.parallel_classify]
+        if pooled:
+            # Train and classify the other models in worker processes,
+            # results are sent back so only this process writes to the database
+            print(f"Running {len(pooled)} models on {min(workers, len(pooled))} worker processes")
+            with ProcessPoolExecutor(max_workers=min(workers, len(pooled))) as executor:
+                futures = {
+                    executor.submit(run_model, model, x_train, x_test, y_train, not models_trained): model_id
+                    for model, model_id in pooled
+                }
+                for future in as_completed(futures):
+                    store_results(future.result(), futures[future], y_train, y_test, models_trained)
+        for model, model_id in chunked:
+            result = run_model(model, x_train, x_test, y_train, not models_trained, workers=workers)
+            store_results(result, model_id, y_train, y_test, models_trained)
+    else:
+        for model, model_id in zip(models, model_ids):
+            result = run_model(model, x_train, x_test, y_train, not models_trained)
+            store_results(result, model_id, y_train, y_test, models_trained)
+
+    # Precompute what the dashboard displays
+    dashboard_snapshot.write_snapshot()
+    # Delete the classification files of the previous analysis, and features of splits not used lately
+    result_store.prune_results()
+    feature_store.prune(feature_store_max_size, feature_store_max_age)
+
+def get_models():
+    # Untrained instances of every model of the analysis
+    models = [
+        VaderModel(),
+        TextBlobDefaultPA(),
+        TextBlobDefaultNBA(),
+        # Same predictions as TextBlobNBC, trained and classified in a fraction of the time
+        TextBlobCompiledNBC(),
+        SklearnNBMD(),
+        SklearnNBMD(ngram_range=(1,2)),
+        SklearnSVM(),
+        SklearnSVM(ngram_range=(1,2)),
+        SklearnSGD(ngram_range=(1,2)),
+        SklearnStreamNB(ngram_range=(1,2))
+    ]
+    names = {model.name for model in models}
+    return models + [model for model in get_selected_models() if model.name not in names]
+
+def get_selected_models():
+    # Models with the parameters chosen by the last model selection
+    model_classes = {'SklearnNBMD': SklearnNBMD, 'SklearnSVM': SklearnSVM, 'SklearnSGD': SklearnSGD}
+    if not os.path.exists(selected_params_path):
+        return []
+    try:
+        with open(selected_params_path, 'r', encoding='utf-8') as f:
+            selected = json.load(f)
+        # JSON has no tuples, e.g. for ngram_range
+        return [model_classes[name](**{key: tuple(value) if isinstance(value, list) else value for key, value in params.items()})
+                for name, params in selected.items() if name in model_classes]
+    except (OSError, ValueError, TypeError) as err:
+        print(f'Failed to load selected model parameters: {err}')
+        return []
+
+def incremental_analysis(registry, trained_models):
+    # Every review, read once for all the models
+    reviews = pd.DataFrame(db_manager.get_manually_reviewed_tweets() or [], columns=['id', 'text', 'sentiment']).set_index('id')
+    for model_id, name, path in trained_models:
+        version = model_version(path)
+        labels = None
+        # Classifications stored as database rows by older versions are classified again into result_store
+        legacy = dict(db_manager.get_classification_labels(model_id) or [])
+        if legacy or version != db_manager.get_analysis_model_version(model_id):
+            # The model file changed since its results were stored, classify every tweet again in the same split
+            print(f'{name}: model changed, re-classifying all tweets')
+            labels = legacy or result_store.read_results(model_id)['label'].to_dict()
+            db_manager.clear_model_analysis(model_id)
+
+        start = time.perf_counter()
+        with db_manager.transaction():
+            classified = analyze_delta(registry, name, model_id, reviews, labels)
+            db_manager.update_analysis_model_version(model_id, version)
+        print(f'{name}: {classified} tweets classified in {time.perf_counter() - start:.2f}s')
+
+def analyze_delta(registry, name, model_id, reviews, labels=None):
+    # Update the stored results of a model with the reviews added, changed or removed since they were stored.
+    # reviews are the reviewed tweets (id, text, sentiment), labels maps tweet ids to their train/test label,
+    # tweets the model has never seen are test data
+    counts = []
+    stored = result_store.read_results(model_id)
+    # Labels whose classifications have to be written again
+    touched = set()
+
+    # Reviews that changed or were removed, only the counts and stored sentiment change
+    current = reviews['sentiment'].reindex(stored.index)
+    is_changed = (stored['sentiment'] != current) & (stored['sentiment'].notna() | current.notna())
+    changed = stored[is_changed]
+    if len(changed):
+        counts += count_classification(changed['label'], changed['sentiment'], changed['classification'], sign=-1)
+        counts += count_classification(changed['label'], current[is_changed], changed['classification'])
+        touched.update(changed['label'])
+        stored.loc[is_changed, 'sentiment'] = current[is_changed]
+        stored = stored[~(is_changed & current.isna())]
+
+    # Reviewed tweets the model has not classified yet, the model is only loaded if there are any
+    new = reviews[reviews['sentiment'].notna() & ~reviews.index.isin(stored.index)]
+    model = registry.get(name) if len(new) else None
+    if model is not None:
+        # Every delta is only transformed once, keep it out of the feature store
+        model.use_feature_store(None)
+        with metrics.timer('model_classify', model=name) as event:
+            classification = model.classify(clean_tweets(new['text']))
+            event['rows'] = len(new)
+        label = pd.Series(new.index.map(labels or {}), index=new.index).fillna('test')
+        stored = pd.concat([stored, pd.DataFrame({'label': label, 'classification': classification, 'sentiment': new['sentiment']})])
+        touched.update(label)
+        counts += count_classification(label, new['sentiment'], classification)
+
+    for label in sorted(touched):
+        rows = stored[stored['label'] == label]
+        result_store.write_results(model_id, label, rows['classification'], rows['sentiment'])
+
+    if counts:
+        db_manager.add_classification_counts(model_id, counts)
+        for label in sorted({row[0] for row in counts}):
+            update_performance(model_id, label)
+    return len(new) if model is not None else 0
+
+def model_version(path):
+    # Hash of the saved model, results are only reused for the exact same model
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def run_model(model, x_train, x_test, y_train, train, workers=1):
+    # (name, seconds, rows) of each step are returned with the results, metrics recorded in worker processes would be lost.
+    # The classification is spread over workers processes
+    timings = []
+
     # Train models
-    if not models_trained:
-        for model in models:
-            print(f"Training model: {model.name}")
+    if train:
+        print(f"Training model: {model.name}")
+        start = time.perf_counter()
+        if getattr(model, 'streaming', False):
+            # Minibatches are read from the database, the training split is never held in memory by the model
+            model.train_stream(lambda: reviewed_batches(exclude=x_test.index))
+        else:
             model.train(x_train,y_train)
-        
+        timings.append(('model_train', time.perf_counter() - start, len(x_train)))
+
     # Classification
-    for model in models:
+    print(f"{model.name}: conducting classification")
+    start = time.perf_counter()
+    classification_train, classification_test = model.classify_batch(x_train, workers=workers), model.classify_batch(x_test, workers=workers)
+    timings.append(('model_classify', time.perf_counter() - start, len(x_train) + len(x_test)))
+    return model, classification_train, classification_test, timings
 
-        #Add or get model id
-        model_id = db_manager.add_analysis_model(model.name)
-        
-        print(f"{model.name}: conducting classification")
+def store_results(result, model_id, y_train, y_test, models_trained):
+    model, classification_train, classification_test, timings = result
+    for name, seconds, rows in timings:
+        metrics.record(name, seconds, rows, model=model.name)
 
+    # Commit the results of both splits at once
+    with db_manager.transaction():
         # Training data
-        classify(model, x_train, y_train, 'train', model_id)
+        store_classification(classification_train, y_train, 'train', model_id)
 
         # Testing data
-        classify(model, x_test, y_test, 'test', model_id)
+        store_classification(classification_test, y_test, 'test', model_id)
 
-        # Save models
-        if not models_trained:
-            save_model(model, model_id)
+    # Save models
+    if not models_trained:
+        save_model(model, model_id)
 
 
 def save_model(model, model_id):
@@ -83,37 +273,58 @@ def save_model(model, model_id):
             print(f'Trained model save directory not found ({trained_model_path}). Creating one.')
             os.mkdir(trained_model_path)
         
-        with open(path, 'wb+') as f:
-            joblib.dump(model, f)
+        # Dump to a path rather than a file object, so the arrays can be memory-mapped on load.
+        # The file is replaced rather than overwritten, processes may have the old one mapped
+        joblib.dump(model, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
         
         # Write to database
         db_manager.update_analysis_model_path(model_id, path)
+        db_manager.update_analysis_model_version(model_id, model_version(path))
 
     except Exception as err:
         print(f'Failed to save model: {err}')
 
-def classify(model, x, y, label, model_id):
-    # get classification
-    classification = model.classify(x)
+def store_classification(classification, y, label, model_id):
+    # Store results, the classifications in files and their counts in the database
+    result_store.write_results(model_id, label, classification, y)
+    db_manager.add_classification_counts(model_id, count_classification(label, y.reindex(classification.index), classification))
+
     # evaluate fitness
-    report = classification_report(y, classification, output_dict=True)
+    update_performance(model_id, label)
 
-    # Store results to database
-    db_manager.add_classification(model_id, label, classification)
-    db_manager.add_classification_performance(model_id, label, report['accuracy'], report['weighted avg']['precision'], report['weighted avg']['recall'], report['weighted avg']['f1-score'])
+def count_classification(label, sentiment, classification, sign=1):
+    # (label, sentiment, classification, count) rows of the confusion counts
+    df = pd.DataFrame({'label': label, 'sentiment': sentiment, 'classification': classification}).dropna()
+    size = df.groupby(['label', 'sentiment', 'classification']).size()
+    return [(name, int(s), int(c), sign * int(n)) for (name, s, c), n in size.items()]
 
-# Function to clean the tweets
-def clean_text(tweet):
-    # Remove @mentions
-    tweet = re.sub(r'@[A-Za-z0-9]+', '',tweet)
-    # Remove hashtags
-    tweet = re.sub(r'#', '', tweet)
-    # Remove RT
-    tweet = re.sub(r'RT[\s]+', '', tweet)
-    # Remove hyperlinks
-    tweet = re.sub(r'https?:\/\/\S+', '',tweet)
+def update_performance(model_id, label):
+    performance = get_performance(db_manager.get_classification_counts(model_id, label) or [])
+    if performance:
+        db_manager.add_classification_performance(model_id, label, *performance)
+    else:
+        db_manager.clear_classification_performance(model_id, label)
 
-    return tweet
+def get_performance(counts):
+    # Accuracy and weighted precision, recall and f1 like sklearn's classification_report, from the confusion counts
+    df = pd.DataFrame(counts, columns=['sentiment', 'classification', 'count'])
+    if df['count'].sum() == 0:
+        return None
+    matrix = df.pivot_table(index='sentiment', columns='classification', values='count', aggfunc='sum', fill_value=0)
+    classes = matrix.index.union(matrix.columns)
+    matrix = matrix.reindex(index=classes, columns=classes, fill_value=0).to_numpy(dtype=float)
+
+    true_positive = np.diag(matrix)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+    # Undefined ratios are 0, as with zero_division=0
+    precision = np.divide(true_positive, predicted, out=np.zeros_like(true_positive), where=predicted > 0)
+    recall = np.divide(true_positive, support, out=np.zeros_like(true_positive), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(true_positive), where=precision + recall > 0)
+
+    weights = support / support.sum()
+    return true_positive.sum() / support.sum(), (precision * weights).sum(), (recall * weights).sum(), (f1 * weights).sum()
 
 def get_reviewed_tweets():
     # Fetch data from database
@@ -125,10 +336,19 @@ def get_reviewed_tweets():
     df = df.dropna()
     return df
 
-def get_dataset():
+def reviewed_batches(batch_size=10000, exclude=()):
+    # (texts, sentiments) of the reviewed tweets read from the database in batches, leaving out the ids in exclude (e.g. the test split)
+    exclude = pd.Index(exclude)
+    for rows in db_manager.iter_manually_reviewed_tweets(batch_size):
+        df = pd.DataFrame(rows, columns=['id','text','sentiment']).set_index('id').dropna()
+        df = df[~df.index.isin(exclude)]
+        if len(df):
+            yield clean_series(df['text']), df['sentiment']
+
+def get_dataset(seed=None):
     df = get_reviewed_tweets()
-    # Clean tweets
-    df['text'] = df.apply(lambda x: clean_text(x['text']), axis = 1)
-    # Split the data into training and testing data
-    x_train, x_test, y_train, y_test = train_test_split(df['text'], df['sentiment'], train_size=0.5)
+    # Clean tweets, reusing the texts cleaned by previous runs
+    df['text'] = clean_tweets(df['text'])
+    # Split the data into training and testing data, the same way on every run
+    x_train, x_test, y_train, y_test = train_test_split(df['text'], df['sentiment'], train_size=0.5, random_state=split_seed if seed is None else seed)
     return x_train, x_test, y_train, y_test
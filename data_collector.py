@@ -1,7 +1,12 @@
 from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import time
+import queue
+import threading
 import tweepy
 import config
 import db_manager
+import metrics
 
 def build_query(search_terms):
     # Put terms into brackets
@@ -12,13 +17,132 @@ def build_query(search_terms):
     q += ' -filter:retweets'
     return q
 
-def get_new_tweets(items=None, minus_days=None, wait_on_rate_limit=False):
-
+def get_api(wait_on_rate_limit=False):
     print("Initialising Twitter API client")
     # Initialise Twitter API
     auth = tweepy.OAuthHandler(config.api_key(), config.api_secret_key())
     auth.set_access_token(config.access_token(), config.access_token_secret())
-    twitter_api = tweepy.API(auth, wait_on_rate_limit=wait_on_rate_limit, wait_on_rate_limit_notify=wait_on_rate_limit)
+    return tweepy.API(auth, wait_on_rate_limit=wait_on_rate_limit, wait_on_rate_limit_notify=wait_on_rate_limit)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, every search request takes one token.
+    The defaults follow the standard search limit of 180 requests per 15 minutes
+    """
+    def __init__(self, rate=180 / 900, capacity=180):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve a token, a negative balance is the queue of requests waiting for one
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+def rate_limited(pages, rate_limiter):
+    # Take a token before every page request
+    pages = iter(pages)
+    while True:
+        rate_limiter.acquire()
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        yield page
+
+class TweetWriter:
+    """
+    Stores fetched pages in the database from a background thread.
+    Pages queued while a write is in progress are grouped into one micro-batch,
+    and the queue is bounded so fetching blocks when the database falls behind.
+    Tweets already stored are ignored by the tweets table, so concurrent fetches can share it.
+    If a write fails, later pages are dropped and close raises the error
+    """
+    def __init__(self, batch_size=500, max_pending=10):
+        self.batch_size = batch_size
+        self.written = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def close(self):
+        # Wait until every queued page is written
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def put(self, tweets, checkpoint=None):
+        # checkpoint is (query, since_id, max_id) saved along with the tweets, a max_id of None clears it
+        self._queue.put((tweets, checkpoint))
+
+    def _run(self):
+        closed = False
+        while not closed:
+            # Wait for a page, then take whatever else is already queued up to batch_size tweets
+            batch = []
+            size = 0
+            item = self._queue.get()
+            while item is not None:
+                batch.append(item)
+                size += len(item[0])
+                if size >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            closed = item is None
+
+            # After a failed write, later pages are dropped so the checkpoint stays before the failure
+            if batch and not self.failed:
+                self._write(batch)
+
+    def _write(self, batch):
+        tweets = [tweet for page, _ in batch for tweet in page]
+        # Only the latest checkpoint of each query matters
+        checkpoints = {checkpoint[0]: checkpoint for _, checkpoint in batch if checkpoint}
+        try:
+            with db_manager.transaction():
+                # Only the tweets that were not stored yet are inserted, UNIQUE(id) ON CONFLICT IGNORE skips the others
+                written = db_manager.add_tweets(tweets)
+                for query, since_id, max_id in checkpoints.values():
+                    if max_id is None:
+                        db_manager.clear_fetch_checkpoint(query)
+                    else:
+                        db_manager.set_fetch_checkpoint(query, since_id, max_id)
+            self.written += written
+        except Exception as err:
+            print(f"Failed to store tweets: {err}")
+            self.error = err
+
+def get_new_tweets(items=None, minus_days=None, wait_on_rate_limit=False, api=None, cursor=tweepy.Cursor, writer=None, rate_limiter=None):
+    # Returns the number of tweets fetched, raises the error of the writer if they could not all be stored
+
+    if api is None:
+        api = get_api(wait_on_rate_limit)
 
     print("Building request")
 
@@ -45,27 +169,85 @@ def get_new_tweets(items=None, minus_days=None, wait_on_rate_limit=False):
     tweet_mode = 'extended'
     # Datetime of a specific date
     until = date.today() - timedelta(days=minus_days + 1) if (minus_days and minus_days > 0) else None
-    # Prevent getting results before since_id which reduces the chance of getting replicated data. Should only be defined if until is None.
-    since_id = db_manager.get_latest_tweet_id() if not until else None
 
+    # Resume from the last stored page if a previous fetch of the same window was interrupted
+    checkpoint_key = f'{query} until:{until}'
+    checkpoint = db_manager.get_fetch_checkpoint(checkpoint_key)
+    if checkpoint:
+        since_id, max_id = checkpoint
+        print(f"Resuming interrupted fetch below tweet id {max_id}")
+    else:
+        # Prevent getting results before since_id which reduces the chance of getting replicated data. Should only be defined if until is None.
+        since_id = db_manager.get_latest_tweet_id() if not until else None
+        max_id = None
+
+    # Without a shared writer, use one for this fetch only
+    own_writer = writer is None
+    if own_writer:
+        writer = TweetWriter().start()
+
+    fetched = 0
     try:
-        # Create an iterator to retrieve tweets
-        tweets = tweepy.Cursor(twitter_api.search, q=query, lang=lang, since_id=since_id, until=until, count=count, tweet_mode=tweet_mode).items(items)
+        # Create an iterator to retrieve pages of tweets
+        pages = cursor(api.search, q=query, lang=lang, since_id=since_id, max_id=max_id, until=until, count=count, tweet_mode=tweet_mode).pages()
+        if rate_limiter:
+            pages = rate_limited(pages, rate_limiter)
 
         print("filtering reponse from twitter")
 
-        entries = list()
-        for tweet in tweets:
+        # Time spent waiting for each page, including the rate limit
+        page_start = time.perf_counter()
+        for page in pages:
+            if writer.failed:
+                print("Stopping the fetch, tweets can no longer be stored")
+                break
+            metrics.record('fetch_page', time.perf_counter() - page_start, len(page), window=str(until))
+            if items:
+                page = page[:items - fetched]
+            if not page:
+                break
+            fetched += len(page)
+
             # Ignore quoted retweets
-            if hasattr(tweet, 'retweeted_status'):
-                continue
-            # Add tweets in list
-            entries.append(tweet)
+            entries = [tweet for tweet in page if not hasattr(tweet, 'retweeted_status')]
+            # Store the page as soon as it arrives, the next page continues below its lowest id
+            writer.put(entries, (checkpoint_key, since_id, min(tweet.id for tweet in page) - 1))
+
+            if items and fetched >= items:
+                break
+            page_start = time.perf_counter()
+
+        # The window is complete, forget its checkpoint
+        if not writer.failed:
+            writer.put([], (checkpoint_key, None, None))
     except Exception as err:
+        metrics.count('fetch_errors', window=str(until))
         print(f"Failed to retrieve tweets from twitter: {err}")
-    
-    print(f"adding {len(entries)} tweets to the database")
-    # Save tweets into database
-    db_manager.add_tweets(entries)
+    finally:
+        if own_writer:
+            writer.close()
+            print(f"{writer.written} tweets added to the database")
+
+    print(f"Fetch data completed")
+    return fetched
+
+def backfill(days=range(7), items=2000, workers=None, wait_on_rate_limit=False, api=None, cursor=tweepy.Cursor, rate_limiter=None):
+    # Returns the number of new tweets stored, raises the error of the writer if they could not all be stored
+    days = list(days)
+
+    # All windows share one API client, one rate limit and one writer
+    if api is None:
+        api = get_api(wait_on_rate_limit)
+    if rate_limiter is None:
+        rate_limiter = TokenBucket()
+
+    def fetch(minus_days):
+        return get_new_tweets(items=items, minus_days=minus_days, api=api, cursor=cursor, writer=writer, rate_limiter=rate_limiter)
+
+    print(f"Fetching {len(days)} day windows concurrently")
+    with TweetWriter() as writer:
+        with ThreadPoolExecutor(max_workers=workers or len(days)) as executor:
+            fetched = sum(executor.map(fetch, days))
 
-    print(f"Fetch data completed")
\ No newline at end of file
+    print(f"Backfill completed: {fetched} tweets fetched, {writer.written} new tweets added to the database")
+    return writer.written
@@ -14,53 +14,116 @@ from sklearn.metrics import confusion_matrix, roc_curve, roc_auc_score
 import pandas as pd
 import numpy as np
 
-import db_manager, data_analyzer
-
-app = dash.Dash(__name__)
-
-dropdown_values = []
-series_sentiment = None
-
+import dashboard_snapshot
+from figure_cache import FigureCache
+
+class DashboardStore:
+    """
+    Read-only state of one dashboard process: the analysis snapshot, the dropdown entries and the figure cache.
+    Nothing is reassigned after loading, so every server worker can hold its own copy
+    """
+    def __init__(self, path=dashboard_snapshot.snapshot_path):
+        # Serve everything from the snapshot written by the analysis, build it from the database only if it is missing
+        self.snapshot = dashboard_snapshot.load_snapshot(path)
+        if self.snapshot is None and dashboard_snapshot.write_snapshot(path):
+            self.snapshot = dashboard_snapshot.load_snapshot(path)
+
+        self.figure_cache = None
+        self.dropdown_values = []
+        if not self.empty:
+            # Figures are kept with the snapshot of the analysis run they belong to
+            self.figure_cache = FigureCache(path=os.path.join(path, self.snapshot.run_id, 'figures'))
+            # Dropdown values and corresponding tuple values
+            self.dropdown_values = [x for x in self.snapshot.get_performance_df()[['model_id', 'model_name', 'label']].itertuples(index=False)]
+
+    @property
+    def empty(self):
+        return self.snapshot is None or self.snapshot.performance.empty
+
+    def get_performance_figures(self, df, label):
+        key = ('performance', label, self.snapshot.run_id)
+        return self.figure_cache.get(key, lambda: [get_barchart(df, 'Bar chart'), get_heatmap(df, 'Heatmap')])
+
+    def classification_figures_key(self, model_id, label):
+        return ('classification', model_id, label, self.snapshot.run_id)
+
+    def build_classification_figures(self, model_id, label):
+        df_classification = self.get_classification_df(model_id, label)
+        return [get_roc_curve(df_classification), get_confusion_matrix(df_classification)]
+
+    def get_classification_figures(self, model_id, label):
+        return self.figure_cache.get(self.classification_figures_key(model_id, label), lambda: self.build_classification_figures(model_id, label))
+
+    def get_classification_df(self, model_id, label):
+        # Classifications in the snapshot are already aligned with the reviewed sentiment
+        return self.snapshot.get_classification_df(model_id, label)
+
+    def warm(self, background=True):
+        # Build the figures of every model so switching models is a cache hit
+        if self.empty:
+            return
+        builders = [
+            (self.classification_figures_key(model_id, label), lambda model_id=model_id, label=label: self.build_classification_figures(model_id, label))
+            for model_id, _, label in self.dropdown_values
+        ]
+        thread = self.figure_cache.warm(builders)
+        if not background:
+            thread.join()
+
+
+def create_app(path=dashboard_snapshot.snapshot_path, background_warm=True, warm=True):
+    # WSGI app factory, every server process builds its own app and store.
+    # warm=False leaves the figures to be built by the first callbacks (e.g. to measure them)
+    app = dash.Dash(__name__)
+    store = DashboardStore(path)
+    app.layout = get_layout(store)
+    register_callbacks(app, store)
+    if warm:
+        store.warm(background_warm)
+    return app
 
 def run():
+    # Single process development server
+    app = create_app()
+    app.run_server(debug=True)
+
+def get_layout(store):
     body = [
         html.H1('Sentiment Analysis results')
     ]
 
-    performance = db_manager.get_all_classification_performance()
-
-    if performance:
-        df = get_performance_df(performance)
+    if not store.empty:
+        df = store.snapshot.get_performance_df()
         df_train, df_test = split_performance_df(df)
 
         # Training data column
+        barchart_train, heatmap_train = store.get_performance_figures(df_train, 'train')
         div_train = html.Div(
             className='grid-col', 
             children=[
                 html.H2('Training Dataset'),
-                dcc.Graph(figure=get_barchart(df_train, 'Bar chart')),
-                dcc.Graph(figure=get_heatmap(df_train, 'Heatmap'))
+                dcc.Graph(figure=barchart_train),
+                dcc.Graph(figure=heatmap_train)
             ])
 
         # Testing data column
+        barchart_test, heatmap_test = store.get_performance_figures(df_test, 'test')
         div_test = html.Div(
             className='grid-col',
             children=[
                 html.H2('Testing Dataset'),
-                dcc.Graph(figure=get_barchart(df_test, 'Bar chart')),
-                dcc.Graph(figure=get_heatmap(df_test, 'Heatmap'))
+                dcc.Graph(figure=barchart_test),
+                dcc.Graph(figure=heatmap_test)
             ])
 
-        # Initiate dropdown values and corresponding tuple values
-        global dropdown_values
-        dropdown_values = [x for x in df[['model_id', 'model_name', 'label']].itertuples(index=False)]
+        dropdown_values = store.dropdown_values
 
         # initial model id and label
         model_id = int(df.iloc[0]['model_id'])
         label = df.iloc[0]['label']
 
         # ROC and Confusion matrix column
-        df_classification = get_classification_df(model_id, label)
+        roc_curve_figure, confusion_matrix_figure = store.get_classification_figures(model_id, label)
 
         dropdown = dcc.Dropdown(
             id='model-dropdown',
@@ -80,8 +143,8 @@ def run():
             className='grid-col', 
             children=[
                 roc_title_span,
-                dcc.Graph(id='roc-curve', figure=get_roc_curve(df_classification)),
-                dcc.Graph(id='confusion-matrix', figure=get_confusion_matrix(df_classification)),
+                dcc.Graph(id='roc-curve', figure=roc_curve_figure),
+                dcc.Graph(id='confusion-matrix', figure=confusion_matrix_figure),
             ])
         
         # finally
@@ -95,9 +158,7 @@ def run():
     else:
          body.append(html.H2('No performance data found! Please perform the whole cycle of model training, analyzing and performance evaluation.'))      
 
-    app.layout = html.Div(children=body)
-
-    app.run_server(debug=True)
+    return html.Div(children=body)
 
 def get_heatmap(df, title):
     fig_data = df.to_numpy()
@@ -156,37 +217,15 @@ def split_performance_df(df) -> tuple:
     columns = ['accuracy', 'precision', 'recall', 'f1']
     return df.loc[df['label'] == 'train'][columns], df.loc[df['label'] == 'test'][columns]
 
-def get_performance_df(performance):
-    df = pd.DataFrame(performance, columns=['model_id', 'label', 'accuracy', 'precision', 'recall', 'f1'])
-    for index, id in df['model_id'].drop_duplicates().iteritems():
-        name = db_manager.get_analysis_model_name(id)
-        df.loc[df['model_id'] == id, 'model_name'] = name
-
-    return df
-
-def get_classification_df(model_id, label):
-    # Check and initialize sentiment series
-    global series_sentiment
-    if not isinstance(series_sentiment, pd.Series):
-        series_sentiment = data_analyzer.get_reviewed_tweets()['sentiment']
-        
-    classification = db_manager.get_classification(model_id, label)
-    if not classification:
-        return None
-    
-    df = pd.DataFrame(classification, columns=['id', 'classification']).set_index('id')
-    df = pd.concat([df, series_sentiment], join='inner', axis=1).dropna()
-    return df
-
 #region callbacks
 
-@app.callback(
-    [Output('roc-curve', 'figure'), Output('confusion-matrix', 'figure')],
-    Input('model-dropdown', 'value'))
-def update_output(value):
-    model_id, _, label = dropdown_values[value]
-    df_classification = get_classification_df(model_id, label)
-    return [get_roc_curve(df_classification), get_confusion_matrix(df_classification)]
+def register_callbacks(app, store):
+    @app.callback(
+        [Output('roc-curve', 'figure'), Output('confusion-matrix', 'figure')],
+        Input('model-dropdown', 'value'))
+    def update_output(value):
+        model_id, _, label = store.dropdown_values[value]
+        return store.get_classification_figures(model_id, label)
 
 #endregion
 
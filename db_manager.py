@@ -1,27 +1,131 @@
 import os
 import sqlite3
+import re
 import datetime
-import pandas as pd
+import inspect
+import functools
+import threading
+import weakref
+from contextlib import contextmanager
+from itertools import repeat
+
+import metrics
 
 db_path = './db/database.db'
 
+# Pragmas applied to every new connection
+pragmas = {
+    # Write-ahead log so readers (the dashboard) are not blocked while analysis writes
+    'journal_mode': 'WAL',
+    # With WAL, only fsync at checkpoints instead of on every commit
+    'synchronous': 'NORMAL',
+    # 64MB page cache (negative values are in KiB)
+    'cache_size': -64000,
+    # Memory-map up to 256MB of the database file
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+# Connection reused by every query made from the same thread
+_local = threading.local()
+
+def get_connection():
+    conn = getattr(_local, 'conn', None)
+    # Reconnect if the database path changed or the process was forked, connections cannot be shared across processes
+    if conn is None or _local.path != db_path or _local.pid != os.getpid():
+        conn = sqlite3.connect(db_path, timeout=30)
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        _local.conn = conn
+        _local.path = db_path
+        _local.pid = os.getpid()
+        _local.depth = 0
+        _local.error = None
+    return conn
+
+def close():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+@contextmanager
+def transaction():
+    # Group all writes made inside the block into a single commit.
+    # Queries print the errors they catch, one inside the block rolls the whole block back and is raised at its end
+    conn = get_connection()
+    if _local.depth == 0:
+        _local.error = None
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0:
+            _local.error = None
+            conn.rollback()
+        raise
+    _local.depth -= 1
+    if _local.depth == 0:
+        error, _local.error = _local.error, None
+        if error is not None:
+            conn.rollback()
+            raise sqlite3.Error(f'Transaction rolled back: {error}') from error
+        conn.commit()
+
 class sqlite_connection:
     def __init__(self, path):
         self.path = path
+        self.conn = None
         
     def __enter__(self):
         try:
-            #try to establish connection with the database and return the cursor
-            self.conn = sqlite3.connect(db_path)
+            #try to get the connection of this thread and return the cursor
+            self.conn = get_connection()
             return self.conn.cursor()
         except sqlite3.Error as e:
             #print out error
             print(e)
     def __exit__(self, type, value, traceback):
-        if self.conn:
-            #commit changes to database and close connection
-            self.conn.commit()
-            self.conn.close()
+        # Changes made inside transaction() are committed when the transaction ends,
+        # or rolled back if a query failed even though its error was caught
+        if self.conn and _local.depth > 0 and type is not None and _local.error is None:
+            _local.error = value
+        if self.conn and _local.depth == 0:
+            if type is None:
+                #commit changes to database, the connection stays open for reuse
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+def timed(function):
+    # Record the duration and the rows returned or changed by every call in metrics.py
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator(*args, **kwargs):
+            with metrics.timer('db_query', query=function.__name__) as event:
+                event['rows'] = 0
+                for rows in function(*args, **kwargs):
+                    event['rows'] += len(rows)
+                    yield rows
+        return generator
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            conn = get_connection()
+            changes = conn.total_changes
+        except sqlite3.Error:
+            # Left to the query to report
+            conn = None
+        with metrics.timer('db_query', query=function.__name__) as event:
+            result = function(*args, **kwargs)
+            if isinstance(result, (list, dict)):
+                event['rows'] = len(result)
+            elif conn is not None:
+                event['rows'] = conn.total_changes - changes
+        return result
+    return wrapper
+
 def init():
     # Create directory
     if not os.path.exists('./db'):
@@ -95,7 +199,214 @@ def init():
             );'''
         cursor.execute(command)
 
+        # Bring the schema up to date
+        migrate(cursor)
+
+# Schema changes applied after the tables above are created, in order.
+# PRAGMA user_version holds the number of migrations already applied to the database
+migrations = [
+    # 1: secondary indexes for the hot queries
+    [
+        'CREATE INDEX IF NOT EXISTS idx_tweets_created_at ON tweets(created_at);',
+        'CREATE INDEX IF NOT EXISTS idx_analysis_models_name ON analysis_models(name);',
+        # Classifications are stored by result_store since migration 7, the index now serves get_classification_labels on legacy rows
+        'CREATE INDEX IF NOT EXISTS idx_analysis_classification_model_label ON analysis_classification(model_id, label, tweet_id, classification);',
+    ],
+    # 2: progress of interrupted tweet fetches
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS fetch_checkpoints(
+            query TEXT NOT NULL,
+            since_id INTEGER,
+            max_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY(query)
+            );''',
+    ],
+    # 3: incremental analysis
+    [
+        # Hash of the model file the stored results were produced with
+        'ALTER TABLE analysis_models ADD COLUMN version TEXT;',
+        # Reviewed sentiment each classification was evaluated against, to find changed reviews
+        'ALTER TABLE analysis_classification ADD COLUMN sentiment INTEGER;',
+        'CREATE INDEX IF NOT EXISTS idx_analysis_classification_model_tweet ON analysis_classification(model_id, tweet_id);',
+        # Confusion counts per model and label, the performance is computed from them
+        '''
+        CREATE TABLE IF NOT EXISTS analysis_counts(
+            model_id INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            sentiment INTEGER NOT NULL,
+            classification INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            FOREIGN KEY (model_id)
+                REFERENCES analysis_models (id),
+            UNIQUE(model_id, label, sentiment, classification)
+            );''',
+    ],
+    # 4: batch scoring of all tweets
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS predictions(
+            model TEXT NOT NULL,
+            tweet_id INTEGER NOT NULL,
+            classification INTEGER NOT NULL,
+            PRIMARY KEY(model, tweet_id)
+            ) WITHOUT ROWID;''',
+        # Rowid of the last tweet each model has scored, replaced by a sequence number in migration 8
+        '''
+        CREATE TABLE IF NOT EXISTS scoring_marks(
+            model TEXT NOT NULL,
+            version TEXT NOT NULL,
+            last_rowid INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY(model)
+            );''',
+    ],
+    # 5: cleaned tweet texts, per version of the cleaner
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS cleaned_tweets(
+            tweet_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY(tweet_id, version)
+            ) WITHOUT ROWID;''',
+    ],
+    # 6: candidates of the model selection are kept apart from the analysed models
+    [
+        "ALTER TABLE analysis_models ADD COLUMN kind TEXT NOT NULL DEFAULT 'analysis';",
+    ],
+    # 7: classifications are stored in files by result_store, the table points at the current ones
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS analysis_results(
+            model_id INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            path TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (model_id)
+                REFERENCES analysis_models (id),
+            PRIMARY KEY(model_id, label)
+            );''',
+    ],
+    # 8: scoring marks on an ingest sequence, the rowids of tweets may be renumbered by VACUUM
+    [
+        # An INTEGER PRIMARY KEY is kept by VACUUM, existing tweets keep their current rowid so the marks stay valid
+        '''
+        CREATE TABLE IF NOT EXISTS tweet_sequence(
+            seq INTEGER PRIMARY KEY,
+            tweet_id INTEGER NOT NULL
+            );''',
+        'INSERT INTO tweet_sequence(seq, tweet_id) SELECT rowid, id FROM tweets ORDER BY rowid;',
+        # Duplicate tweets are ignored by the insert, so only new tweets get a number
+        '''
+        CREATE TRIGGER IF NOT EXISTS tweets_sequence AFTER INSERT ON tweets
+        BEGIN
+            INSERT INTO tweet_sequence(tweet_id) VALUES (NEW.id);
+        END;''',
+        '''
+        CREATE TABLE scoring_marks_seq(
+            model TEXT NOT NULL,
+            version TEXT NOT NULL,
+            last_seq INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY(model)
+            );''',
+        'INSERT INTO scoring_marks_seq SELECT model, version, last_rowid, updated_at FROM scoring_marks;',
+        'DROP TABLE scoring_marks;',
+        'ALTER TABLE scoring_marks_seq RENAME TO scoring_marks;',
+    ],
+]
+
+def migrate(cursor):
+    cursor.execute('PRAGMA user_version;')
+    version = cursor.fetchone()[0]
+    for number, commands in enumerate(migrations[version:], start=version + 1):
+        print(f'Applying database migration {number}')
+        for command in commands:
+            cursor.execute(command)
+        cursor.execute(f'PRAGMA user_version = {number};')
+
+# Queries run per request or over whole tables, checked by check_query_plans
+latest_tweet_id_query = """
+    SELECT MAX(id)
+    FROM tweets
+"""
+
+unreviewed_tweets_query = """
+    SELECT id, text
+    FROM tweets
+    WHERE NOT EXISTS
+        (SELECT 1
+        FROM review_results
+        WHERE review_results.tweet_id = tweets.id)
+"""
+
+# CROSS JOIN makes SQLite loop over the (small) review table and look tweets up by id
+reviewed_tweets_query = """
+    SELECT review_results.tweet_id, tweets.text, review_results.sentiment
+    FROM (review_results 
+    CROSS JOIN tweets ON tweets.id = review_results.tweet_id);
+"""
+
+analysis_model_id_query = """
+    SELECT id
+    FROM analysis_models
+    WHERE name = ?;
+"""
+
+analysis_result_query = """
+    SELECT path
+    FROM analysis_results
+    WHERE model_id = ? AND label = ?;
+"""
+
+# Next chunk of tweets in insertion order, after the given sequence number
+tweets_after_query = """
+    SELECT tweet_sequence.seq, tweets.id, tweets.text
+    FROM (tweet_sequence
+    CROSS JOIN tweets ON tweets.id = tweet_sequence.tweet_id)
+    WHERE tweet_sequence.seq > ?
+    ORDER BY tweet_sequence.seq
+    LIMIT ?;
+"""
+
+# Formatted with one placeholder per tweet id
+cleaned_tweets_query = """
+    SELECT tweet_id, text
+    FROM cleaned_tweets
+    WHERE version = ? AND tweet_id IN ({});
+"""
+
+# name: (query, sample parameters, tables the query is expected to scan in full)
+hot_queries = {
+    'get_latest_tweet_id': (latest_tweet_id_query, (), ()),
+    # Every tweet is returned, only the review lookup has to use an index
+    'get_unreviewed_tweets': (unreviewed_tweets_query, (), ('tweets',)),
+    'get_manually_reviewed_tweets': (reviewed_tweets_query, (), ('review_results',)),
+    'get_analysis_model_id': (analysis_model_id_query, ('',), ()),
+    'get_analysis_result': (analysis_result_query, (0, 'test'), ()),
+    'get_tweets_after': (tweets_after_query, (0, 10000), ()),
+    'get_cleaned_tweets': (cleaned_tweets_query.format('?'), (1, 0), ()),
+}
+
+def check_query_plans():
+    # Return (query name, plan detail) for every hot query that falls back to an unexpected full scan
+    failures = []
+    with sqlite_connection(db_path) as cursor:
+        for name, (command, values, scanned_tables) in hot_queries.items():
+            cursor.execute(f'EXPLAIN QUERY PLAN {command}', values)
+            for row in cursor.fetchall():
+                detail = row[-1]
+                # Older SQLite versions print "SCAN TABLE name"
+                match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+                if match and match.group(1) not in scanned_tables:
+                    failures.append((name, detail))
+    return failures
+
 #region raw data
+@timed
 def add_tweets(tweets):
     with sqlite_connection(db_path) as cursor:
         command = """
@@ -123,39 +434,80 @@ def add_tweets(tweets):
                     x.retweet_count),
                     tweets)
         cursor.executemany(command,values)
+        # Tweets inserted, the ones already stored and the rows of the sequence trigger are not counted
+        return cursor.rowcount
 
+@timed
 def get_latest_tweet_id():
     try:
         with sqlite_connection(db_path) as cursor:
             if cursor:
-                command = """
-                    SELECT MAX(id)
-                    FROM tweets
-                """
-                cursor.execute(command)
+                cursor.execute(latest_tweet_id_query)
                 result = cursor.fetchone()
                 return result[0] if result else None
     except sqlite3.Error as err:
         print(f"Failed to retrieve latest tweet id: {err}")
         return None
 
+@timed
+def get_fetch_checkpoint(query):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT since_id, max_id
+                FROM fetch_checkpoints
+                WHERE query = ?;
+            """
+            cursor.execute(command, (query,))
+            return cursor.fetchone()
+    except sqlite3.Error as err:
+        print(f"Failed to retrieve fetch checkpoint: {err}")
+        return None
+
+@timed
+def set_fetch_checkpoint(query, since_id, max_id):
+    with sqlite_connection(db_path) as cursor:
+        command = """
+            INSERT INTO fetch_checkpoints(query, since_id, max_id, updated_at)
+                VALUES(?,?,?,?)
+            ON CONFLICT (query) DO UPDATE SET
+                since_id=excluded.since_id,
+                max_id=excluded.max_id,
+                updated_at=excluded.updated_at;
+        """
+        cursor.execute(command, (query, since_id, max_id, datetime.datetime.now().isoformat()))
+
+@timed
+def clear_fetch_checkpoint(query):
+    with sqlite_connection(db_path) as cursor:
+        command = """
+            DELETE FROM fetch_checkpoints
+            WHERE query = ?;
+        """
+        cursor.execute(command, (query,))
+
+@timed
 def get_unreviewed_tweets():
     try:
         with sqlite_connection(db_path) as cursor:
             if cursor:
-                command = """
-                    SELECT id, text
-                    FROM tweets
-                    WHERE id NOT IN
-                        (SELECT tweet_id 
-                        FROM review_results)
-                """
-                cursor.execute(command)
+                cursor.execute(unreviewed_tweets_query)
                 return cursor.fetchall()
     except:
         return None
+@timed
+def iter_unreviewed_tweets(batch_size=10000):
+    # Stream (id, text) rows in batches instead of loading the whole table
+    with sqlite_connection(db_path) as cursor:
+        cursor.execute(unreviewed_tweets_query)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
 #endregion
 #region reviewed tweets
+@timed
 def add_manually_reviewed_tweets(tweets):
     try:
         with sqlite_connection(db_path) as cursor:
@@ -173,43 +525,60 @@ def add_manually_reviewed_tweets(tweets):
     except sqlite3.Error as err:
         print(f"{err}")
         return None
+@timed
 def get_manually_reviewed_tweets():
     try:
         with sqlite_connection(db_path) as cursor:
-            command = """
-                SELECT review_results.tweet_id, tweets.text, review_results.sentiment
-                FROM (tweets 
-                INNER JOIN review_results ON tweets.id = review_results.tweet_id);
-            """
-            cursor.execute(command)
+            cursor.execute(reviewed_tweets_query)
             return cursor.fetchall()
     except:
         return None
+@timed
+def iter_manually_reviewed_tweets(batch_size=10000):
+    # Stream (id, text, sentiment) rows in batches, for models trained out of core
+    with sqlite_connection(db_path) as cursor:
+        cursor.execute(reviewed_tweets_query)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
 #endregion
 #region analysed tweets
+# Called after the analysis tables are cleared, e.g. to drop figures cached from the previous results.
+# Weak references to a callback (weakref.WeakMethod) are called while their object is alive
+analysis_cleared_callbacks = []
+
+@timed
 def clear_analysis_tables():
+    # Results of the model selection are kept
     with sqlite_connection(db_path) as cursor:
-        command = """
-            DELETE FROM analysis_models;
-        """
-        cursor.execute(command)
+        for table in ('analysis_classification', 'analysis_results', 'analysis_performance', 'analysis_counts'):
+            cursor.execute(f"""
+                DELETE FROM {table}
+                WHERE model_id IN (SELECT id FROM analysis_models WHERE kind = 'analysis');
+            """)
 
         command = """
-            DELETE FROM analysis_classification;
+            DELETE FROM analysis_models
+            WHERE kind = 'analysis';
         """
         cursor.execute(command)
 
-        command = """
-            DELETE FROM analysis_performance;
-        """
-        cursor.execute(command)
+    for callback in list(analysis_cleared_callbacks):
+        if isinstance(callback, weakref.ref):
+            callback = callback()
+        if callback is not None:
+            callback()
 
+@timed
 def get_analysis_models():
     try:
         with sqlite_connection(db_path) as cursor:
             command = """
                 SELECT id, name, path
                 FROM analysis_models
+                WHERE kind = 'analysis'
             """
             cursor.execute(command)
             return cursor.fetchall()
@@ -217,6 +586,7 @@ def get_analysis_models():
         print(err)
         return None
 
+@timed
 def get_analysis_model_name(id) -> str:
     try:
         with sqlite_connection(db_path) as cursor:
@@ -232,43 +602,33 @@ def get_analysis_model_name(id) -> str:
         print(err)
         return None
 
+@timed
 def get_analysis_model_id(name) -> int:
     try:
         with sqlite_connection(db_path) as cursor:
-            command = """
-                SELECT id
-                FROM analysis_models
-                WHERE name = ?;
-            """
-            cursor.execute(command, (name,))
+            cursor.execute(analysis_model_id_query, (name,))
             result = cursor.fetchone()
             return result[0] if result else None
     except sqlite3.Error as err:
         print(err)
         return None
 
-def add_analysis_model(name) -> int:
+@timed
+def add_analysis_model(name, kind='analysis') -> int:
     try:
         with sqlite_connection(db_path) as cursor:
             command = """
-                INSERT INTO analysis_models(name)
-                    VALUES(?);
+                INSERT INTO analysis_models(name, kind)
+                    VALUES(?,?);
                 """
-            cursor.execute(command, (name,))
-
-            command = """
-                SELECT id
-                FROM analysis_models
-                WHERE name = ?;
-            """
-            cursor.execute(command, (name,))
-
-            result = cursor.fetchone()
-            return result[0] if result else None
+            cursor.execute(command, (name, kind))
+            # The same name can be used by an analysed model and a model selection candidate
+            return cursor.lastrowid
     except sqlite3.Error as err:
         print(err)
         return None
 
+@timed
 def update_analysis_model_path(model_id, path):
         try:
             with sqlite_connection(db_path) as cursor:
@@ -282,39 +642,148 @@ def update_analysis_model_path(model_id, path):
             print(err)
             return None
 
-def get_classification(model_id, label):
+@timed
+def get_analysis_model_version(model_id):
     try:
         with sqlite_connection(db_path) as cursor:
-            command = f"""
-                SELECT tweet_id, classification 
+            command = """
+                SELECT version
+                FROM analysis_models
+                WHERE id = ?;
+            """
+            cursor.execute(command, (model_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def update_analysis_model_version(model_id, version):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                UPDATE analysis_models
+                SET version = ?
+                WHERE id = ?
+                """
+            cursor.execute(command, (version, model_id))
+    except sqlite3.Error as err:
+        print(err)
+
+@timed
+def clear_model_analysis(model_id):
+    # Remove the stored results of one model, keeping the model itself
+    with sqlite_connection(db_path) as cursor:
+        for table in ('analysis_classification', 'analysis_results', 'analysis_counts', 'analysis_performance'):
+            cursor.execute(f'DELETE FROM {table} WHERE model_id = ?;', (model_id,))
+
+@timed
+def get_analysis_result(model_id, label):
+    # Path prefix of the stored classification files of a model and label
+    try:
+        with sqlite_connection(db_path) as cursor:
+            cursor.execute(analysis_result_query, (model_id, label))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def get_analysis_results(model_id):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT label, path, rows
+                FROM analysis_results
+                WHERE model_id = ?
+                ORDER BY label;
+            """
+            cursor.execute(command, (model_id,))
+            return cursor.fetchall()
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def get_all_analysis_result_paths():
+    try:
+        with sqlite_connection(db_path) as cursor:
+            cursor.execute('SELECT path FROM analysis_results;')
+            return [row[0] for row in cursor.fetchall()]
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def set_analysis_result(model_id, label, path, rows):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                INSERT INTO analysis_results(model_id, label, path, rows, created_at)
+                    VALUES(?,?,?,?,?)
+                ON CONFLICT (model_id, label) DO UPDATE SET
+                    path=excluded.path, rows=excluded.rows, created_at=excluded.created_at;
+                """
+            cursor.execute(command, (model_id, label, path, rows, datetime.datetime.now().isoformat()))
+    except sqlite3.Error as err:
+        print(err)
+
+@timed
+def get_classification_labels(model_id):
+    # Labels of the classifications stored as rows by older versions, before result_store
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT tweet_id, label
                 FROM analysis_classification
-                WHERE model_id = ? AND label = ?;
+                WHERE model_id = ?;
             """
-            values = (model_id, label)
-            cursor.execute(command, values)
+            cursor.execute(command, (model_id,))
+            return cursor.fetchall()
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def get_classification_counts(model_id, label):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT sentiment, classification, count
+                FROM analysis_counts
+                WHERE model_id = ? AND label = ? AND count > 0;
+            """
+            cursor.execute(command, (model_id, label))
             return cursor.fetchall()
     except sqlite3.Error as err:
         print(err)
         return None
 
-def add_classification(model_id, label, classification: pd.Series):
+@timed
+def add_classification_counts(model_id, counts):
+    # counts: (label, sentiment, classification, count) rows added to the stored counts, negative counts subtract
     try:
         with sqlite_connection(db_path) as cursor:
             command = """
-                INSERT INTO analysis_classification(model_id, label, tweet_id, classification)
-                    VALUES(?,?,?,?);
+                INSERT INTO analysis_counts(model_id, label, sentiment, classification, count)
+                    VALUES(?,?,?,?,?)
+                ON CONFLICT (model_id, label, sentiment, classification) DO UPDATE SET
+                    count=count + excluded.count;
                 """
-            values = map(lambda x: (model_id, label, x[0], x[1]), classification.iteritems())
-            cursor.executemany(command, values)
+            cursor.executemany(command, ((model_id, *row) for row in counts))
     except sqlite3.Error as err:
         print(err)
 
+@timed
 def get_all_classification_performance():
     try:
         with sqlite_connection(db_path) as cursor:
             command = f"""
                 SELECT model_id, label, accuracy, precision, recall, f1
                 FROM analysis_performance
+                WHERE model_id IN (SELECT id FROM analysis_models WHERE kind = 'analysis')
             """
             cursor.execute(command)
             return cursor.fetchall()
@@ -322,6 +791,7 @@ def get_all_classification_performance():
         print(err)
         return None
 
+@timed
 def get_classification_performance(model_id, label):
     try:
         with sqlite_connection(db_path) as cursor:
@@ -338,16 +808,159 @@ def get_classification_performance(model_id, label):
         print(err)
         return None
 
+@timed
+def clear_classification_performance(model_id, label):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                DELETE FROM analysis_performance
+                WHERE model_id = ? AND label = ?;
+                """
+            cursor.execute(command, (model_id, label))
+    except sqlite3.Error as err:
+        print(err)
+
+@timed
 def add_classification_performance(model_id, label, accuracy, precision, recall, f1):
     try:
         with sqlite_connection(db_path) as cursor:
             command = """
                 INSERT INTO analysis_performance(model_id, label, accuracy, precision, recall, f1)
-                    VALUES(?,?,?,?,?,?);
+                    VALUES(?,?,?,?,?,?)
+                ON CONFLICT (model_id, label) DO UPDATE SET
+                    accuracy=excluded.accuracy,
+                    precision=excluded.precision,
+                    recall=excluded.recall,
+                    f1=excluded.f1;
                 """
             values = (model_id, label, accuracy, precision, recall, f1)
             cursor.execute(command, values)
     except sqlite3.Error as err:
         print(err)
+
+@timed
+def clear_model_selection():
+    with sqlite_connection(db_path) as cursor:
+        command = """
+            DELETE FROM analysis_performance
+            WHERE model_id IN (SELECT id FROM analysis_models WHERE kind = 'selection');
+        """
+        cursor.execute(command)
+
+        command = """
+            DELETE FROM analysis_models
+            WHERE kind = 'selection';
+        """
+        cursor.execute(command)
+
+@timed
+def get_model_selection_performance():
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT analysis_models.name, analysis_performance.label, accuracy, precision, recall, f1
+                FROM analysis_performance
+                JOIN analysis_models ON analysis_models.id = analysis_performance.model_id
+                WHERE analysis_models.kind = 'selection'
+                ORDER BY analysis_models.id, analysis_performance.label;
+            """
+            cursor.execute(command)
+            return cursor.fetchall()
+    except sqlite3.Error as err:
+        print(err)
+        return None
+#endregion
+#region predictions
+@timed
+def get_tweets_after(seq, limit):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            cursor.execute(tweets_after_query, (seq, limit))
+            return cursor.fetchall()
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def get_scoring_marks():
+    # model: (version, last_seq)
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT model, version, last_seq
+                FROM scoring_marks
+            """
+            cursor.execute(command)
+            return {model: (version, last_seq) for model, version, last_seq in cursor.fetchall()}
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def set_scoring_mark(model, version, last_seq):
+    with sqlite_connection(db_path) as cursor:
+        command = """
+            INSERT INTO scoring_marks(model, version, last_seq, updated_at)
+                VALUES(?,?,?,?)
+            ON CONFLICT (model) DO UPDATE SET
+                version=excluded.version,
+                last_seq=excluded.last_seq,
+                updated_at=excluded.updated_at;
+        """
+        cursor.execute(command, (model, version, last_seq, datetime.datetime.now().isoformat()))
+
+@timed
+def add_predictions(model, tweet_ids, classifications):
+    with sqlite_connection(db_path) as cursor:
+        command = """
+            INSERT OR REPLACE INTO predictions(model, tweet_id, classification)
+                VALUES(?,?,?);
+        """
+        cursor.executemany(command, zip(repeat(model), tweet_ids, classifications))
+
+@timed
+def get_predictions(model):
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                SELECT tweet_id, classification
+                FROM predictions
+                WHERE model = ?;
+            """
+            cursor.execute(command, (model,))
+            return cursor.fetchall()
+    except sqlite3.Error as err:
+        print(err)
+        return None
+#endregion
+#region cleaned tweets
+@timed
+def get_cleaned_tweets(tweet_ids, version, batch_size=500):
+    # (tweet_id, text) of the given tweets cleaned by that cleaner version, looked up batch_size ids per query
+    tweet_ids = list(tweet_ids)
+    rows = []
+    try:
+        with sqlite_connection(db_path) as cursor:
+            for start in range(0, len(tweet_ids), batch_size):
+                batch = tweet_ids[start:start + batch_size]
+                cursor.execute(cleaned_tweets_query.format(','.join('?' * len(batch))), (version, *batch))
+                rows += cursor.fetchall()
+        return rows
+    except sqlite3.Error as err:
+        print(err)
+        return None
+
+@timed
+def add_cleaned_tweets(tweets, version):
+    # tweets: (tweet_id, text) pairs
+    try:
+        with sqlite_connection(db_path) as cursor:
+            command = """
+                INSERT OR REPLACE INTO cleaned_tweets(tweet_id, version, text)
+                    VALUES(?,?,?);
+            """
+            cursor.executemany(command, ((tweet_id, version, text) for tweet_id, text in tweets))
+    except sqlite3.Error as err:
+        print(err)
 #endregion
 init()
\ No newline at end of file
@@ -0,0 +1,217 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+
+def data_hash(x: pd.Series) -> str:
+    # Hash of both ids and text, the row order of the matrix depends on both
+    return hashlib.sha1(pd.util.hash_pandas_object(x, index=True).values.tobytes()).hexdigest()
+
+def params_hash(vectorizer) -> str:
+    params = vectorizer.get_params()
+    # Stop words are a set, sort them so the key does not depend on iteration order
+    stop_words = params.pop('stop_words')
+    if stop_words is not None and not isinstance(stop_words, str):
+        stop_words = sorted(stop_words)
+    params = sorted((name, repr(value)) for name, value in params.items())
+    return hashlib.sha1(repr((type(vectorizer).__name__, params, stop_words)).encode('utf-8')).hexdigest()
+
+
+class FeatureStore:
+    """
+    Shares fitted vectorizers and their feature matrices between models.
+    Entries are keyed by the vectorizer parameters and a hash of the dataset,
+    and are optionally persisted to disk as memory-mappable sparse arrays.
+    Every new split of the data adds entries on disk, prune deletes those not used recently
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._vectorizers = {}
+        self._matrices = {}
+
+    def __getstate__(self):
+        # Only the location is pickled along with the models, not the cached matrices
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def fit_key(self, vectorizer, x) -> str:
+        return hashlib.sha1(f'{params_hash(vectorizer)}:{data_hash(x)}'.encode('utf-8')).hexdigest()
+
+    def get_vectorizer(self, key):
+        if key in self._vectorizers:
+            return self._vectorizers[key]
+        path = self._entry_path(key, 'vectorizer.joblib')
+        if path and os.path.exists(path):
+            try:
+                vectorizer = joblib.load(path)
+                self._vectorizers[key] = vectorizer
+                self._touch(key)
+                return vectorizer
+            except Exception as err:
+                print(f'Failed to load cached vectorizer: {err}')
+        return None
+
+    def add_vectorizer(self, key, vectorizer):
+        self._vectorizers[key] = vectorizer
+        if self.path:
+            self._write(key, 'vectorizer.joblib', lambda path: joblib.dump(vectorizer, path))
+
+    def get_matrix(self, key, x, transform):
+        # Return the cached matrix of x for the vectorizer fitted under key, transforming it only once
+        matrix_key = (key, data_hash(x))
+        if matrix_key in self._matrices:
+            return self._matrices[matrix_key]
+
+        matrix = self._load_matrix(*matrix_key)
+        if matrix is None:
+            matrix = transform(x).tocsr()
+            matrix.sort_indices()
+            self._save_matrix(*matrix_key, matrix)
+
+        self._matrices[matrix_key] = matrix
+        return matrix
+
+    def add_matrix(self, key, x, matrix):
+        matrix = matrix.tocsr()
+        matrix.sort_indices()
+        matrix_key = (key, data_hash(x))
+        self._matrices[matrix_key] = matrix
+        self._save_matrix(*matrix_key, matrix)
+        return matrix
+
+    def prune(self, max_size=2 * 1024 ** 3, max_age=30 * 24 * 3600):
+        # Delete the entries on disk not used for max_age seconds, then the least recently used ones
+        # until the store takes at most max_size bytes. Returns the number of entries deleted
+        if not self.path or not os.path.isdir(self.path):
+            return 0
+        entries = []
+        for key in os.listdir(self.path):
+            directory = os.path.join(self.path, key)
+            if os.path.isdir(directory):
+                entries.append((os.path.getmtime(directory), self._size(directory), key))
+
+        # Least recently used first
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        removed = 0
+        for used, size, key in entries:
+            if now - used <= max_age and total <= max_size:
+                break
+            # Files still mapped by another process may fail to delete on Windows, they are tried again next time
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            self._vectorizers.pop(key, None)
+            self._matrices = {matrix_key: matrix for matrix_key, matrix in self._matrices.items() if matrix_key[0] != key}
+            total -= size
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _size(directory):
+        size = 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return size
+
+    def _touch(self, key):
+        # The modification time of an entry is the last time it was used
+        try:
+            os.utime(os.path.join(self.path, key))
+        except OSError:
+            pass
+
+    def _entry_path(self, key, name):
+        return os.path.join(self.path, key, name) if self.path else None
+
+    def _load_matrix(self, key, x_hash):
+        path = self._entry_path(key, x_hash)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            # Memory-map the CSR components copy-on-write, classifiers may touch them in place
+            data, indices, indptr = (np.load(os.path.join(path, f'{name}.npy'), mmap_mode='c') for name in ('data', 'indices', 'indptr'))
+            shape = tuple(np.load(os.path.join(path, 'shape.npy')))
+            self._touch(key)
+            return scipy.sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+        except Exception as err:
+            print(f'Failed to load cached feature matrix: {err}')
+            return None
+
+    def _save_matrix(self, key, x_hash, matrix):
+        if not self.path:
+            return
+
+        def write(path):
+            os.mkdir(path)
+            np.save(os.path.join(path, 'data.npy'), matrix.data)
+            np.save(os.path.join(path, 'indices.npy'), matrix.indices)
+            np.save(os.path.join(path, 'indptr.npy'), matrix.indptr)
+            np.save(os.path.join(path, 'shape.npy'), np.array(matrix.shape))
+
+        self._write(key, x_hash, write)
+
+    def _write(self, key, name, write):
+        # Write under a temporary name and rename it, so concurrent runs never see partial entries
+        directory = os.path.join(self.path, key)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        tmp_path = os.path.join(directory, f'.{name}.{uuid.uuid4().hex}')
+        try:
+            write(tmp_path)
+            if not os.path.exists(path):
+                os.replace(tmp_path, path)
+        except Exception as err:
+            print(f'Failed to save feature cache: {err}')
+        finally:
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class CachedVectorizer:
+    """
+    Wraps a sklearn vectorizer so fitting and transforming go through a FeatureStore
+    """
+    def __init__(self, vectorizer, store=None):
+        self.vectorizer = vectorizer
+        self.store = store
+        # Identifies the data the vectorizer was fitted on, None if unknown
+        self.key = None
+
+    def fit(self, x):
+        self.fit_transform(x)
+        return self
+
+    def fit_transform(self, x):
+        if self.store is None:
+            self.key = None
+            return self.vectorizer.fit_transform(x)
+
+        self.key = self.store.fit_key(self.vectorizer, x)
+        vectorizer = self.store.get_vectorizer(self.key)
+        if vectorizer is not None:
+            # Another model already fitted the same vocabulary
+            self.vectorizer = vectorizer
+            return self.transform(x)
+
+        matrix = self.vectorizer.fit_transform(x)
+        self.store.add_vectorizer(self.key, self.vectorizer)
+        return self.store.add_matrix(self.key, x, matrix)
+
+    def transform(self, x):
+        if self.store is None or self.key is None:
+            return self.vectorizer.transform(x)
+        return self.store.get_matrix(self.key, x, self.vectorizer.transform)
@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import shutil
+import threading
+import weakref
+from collections import OrderedDict
+import plotly.io
+
+import db_manager
+
+
+def _remove_callback(reference):
+    try:
+        db_manager.analysis_cleared_callbacks.remove(reference)
+    except ValueError:
+        pass
+
+class FigureCache:
+    """
+    Thread-safe LRU cache of dashboard figures.
+    Keys should contain the analysis run id: that is what keeps the figures of an older run from being served,
+    the dashboard processes never see the analysis tables being cleared.
+    With a path, figures are also written to disk as JSON and survive server restarts.
+    The cache is also emptied if db_manager.clear_analysis_tables runs in the same process while it is alive
+    """
+    def __init__(self, max_size=256, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+        # Referenced weakly so the callbacks do not keep every cache alive, the reference is removed with the cache
+        db_manager.analysis_cleared_callbacks.append(weakref.WeakMethod(self.clear, _remove_callback))
+
+    def get(self, key, build):
+        # Return the cached figures of key, building them with build() on a miss
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return self._figures[key]
+            self.misses += 1
+
+        # Build outside of the lock so other keys can be served meanwhile
+        figures = self._load(key)
+        if figures is None:
+            figures = build()
+            self._save(key, figures)
+
+        with self._lock:
+            self._figures[key] = figures
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.max_size:
+                self._figures.popitem(last=False)
+        return figures
+
+    def warm(self, builders):
+        # Build the figures of every (key, build) pair on a background thread
+        def run():
+            for key, build in builders:
+                try:
+                    self.get(key, build)
+                except Exception as err:
+                    print(f'Failed to build figure {key}: {err}')
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def _file_path(self, key):
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', '-'.join(map(str, key)))
+        return os.path.join(self.path, f'{name}.json')
+
+    def _load(self, key):
+        if not self.path or not os.path.exists(self._file_path(key)):
+            return None
+        try:
+            with open(self._file_path(key), 'r', encoding='utf-8') as f:
+                return [plotly.io.from_json(figure) for figure in json.load(f)]
+        except Exception as err:
+            print(f'Failed to load cached figure {key}: {err}')
+            return None
+
+    def _save(self, key, figures):
+        if not self.path:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Write under a temporary name so concurrent readers never see a partial file, server workers share the directory
+            tmp_path = f'{self._file_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([figure.to_json() for figure in figures], f)
+            os.replace(tmp_path, self._file_path(key))
+        except Exception as err:
+            print(f'Failed to save cached figure {key}: {err}')
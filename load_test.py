@@ -0,0 +1,95 @@
+import json
+import time
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Load test of a running dashboard: sends concurrent model-dropdown callbacks and reports their latency
+
+def get_dropdown_size(url):
+    # Number of entries of the model dropdown in the served layout
+    with urllib.request.urlopen(f'{url}/_dash-layout') as response:
+        layout = json.load(response)
+
+    def find(component):
+        if isinstance(component, dict):
+            if component.get('props', {}).get('id') == 'model-dropdown':
+                return len(component['props']['options'])
+            children = component.get('props', {}).get('children')
+            return find(children) if children is not None else None
+        if isinstance(component, list):
+            for child in component:
+                size = find(child)
+                if size is not None:
+                    return size
+        return None
+
+    return find(layout)
+
+def callback_payload(value):
+    # Body of the model-dropdown callback request sent by the browser
+    return {
+        'output': '..roc-curve.figure...confusion-matrix.figure..',
+        'outputs': [{'id': 'roc-curve', 'property': 'figure'}, {'id': 'confusion-matrix', 'property': 'figure'}],
+        'inputs': [{'id': 'model-dropdown', 'property': 'value', 'value': value}],
+        'changedPropIds': ['model-dropdown.value'],
+        'state': [],
+    }
+
+def callback_request(url, value):
+    return urllib.request.Request(
+        f'{url}/_dash-update-component',
+        data=json.dumps(callback_payload(value)).encode('utf-8'),
+        headers={'Content-Type': 'application/json'})
+
+def run(url, requests, concurrency):
+    size = get_dropdown_size(url)
+    if not size:
+        print('The dashboard has no model dropdown, run the analysis first')
+        return None
+
+    def send(i):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(callback_request(url, i % size)) as response:
+                response.read()
+            return time.perf_counter() - start, True
+        except Exception as err:
+            print(f'Request {i} failed: {err}')
+            return time.perf_counter() - start, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, ok in results if ok]) * 1000
+    errors = sum(not ok for _, ok in results)
+    report = {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput': requests / elapsed,
+    }
+    if len(latencies):
+        report.update({
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'max_ms': float(latencies.max()),
+        })
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='Address of the running dashboard')
+    parser.add_argument('--requests', type=int, default=1000, help='Number of callback requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of requests in flight at the same time')
+
+    args = parser.parse_args()
+
+    report = run(args.url.rstrip('/'), args.requests, args.concurrency)
+    if report:
+        print(f"{report['requests']} requests at concurrency {report['concurrency']}: {report['throughput']:.1f} requests/s, {report['errors']} errors")
+        if 'p50_ms' in report:
+            print(f"p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms, max {report['max_ms']:.1f} ms")
@@ -1,22 +1,55 @@
 import data_collector
 import data_analyzer
+import tweet_scoring
+import model_selection
+import metrics
 import argparse
 import sys
 import subprocess
 
-def main(fetch_new_tweets=False, retrain=False, reanalyze=False):
+def main(fetch_new_tweets=False, retrain=False, reanalyze=False, workers=1, days=7, serve_workers=0, full_analysis=False, score=None,
+         metrics_port=None, metrics_log=None, profile=None, profile_output=None, select=None):
 
-    if fetch_new_tweets:
-        # Get all the data from the past 7 days
-        for minus_days in range(7):
-           data_collector.get_new_tweets(items=2000, minus_days=minus_days)
+    if metrics_port:
+        # Stays available while the dashboard runs
+        metrics.serve(metrics_port)
+    if metrics_log:
+        metrics.registry.open_log(metrics_log)
 
-    if retrain or reanalyze:
-        # Wipe out and retrain all models
-        data_analyzer.sentiment_analysis(retrain)
+    with metrics.profile(profile, profile_output):
+        if fetch_new_tweets:
+            # Get all the data from the past days, fetching the day windows concurrently
+            with metrics.timer('pipeline_stage', stage='fetch'):
+                data_collector.backfill(range(days), items=2000)
+
+        if select is not None:
+            # Cross-validate the parameters of all or the given Sklearn models, the best ones are trained with the others
+            with metrics.timer('pipeline_stage', stage='selection'):
+                model_selection.select_models(select or None, workers=workers)
+
+        if retrain or reanalyze:
+            # Wipe out and retrain all models, or only classify the reviews that changed since the last analysis
+            with metrics.timer('pipeline_stage', stage='analysis'):
+                data_analyzer.sentiment_analysis(retrain, workers=workers, incremental=not full_analysis)
+
+        if score is not None:
+            # Classify the tweets stored since the last scoring run, with all or the given trained models
+            with metrics.timer('pipeline_stage', stage='scoring'):
+                tweet_scoring.score_tweets(score or None, workers=workers)
+
+    if metrics_port or metrics_log:
+        # Where the run spent its time
+        metrics.print_summary()
+    metrics.registry.close_log()
+
+    if serve_workers:
+        # Production server, the app is created once and forked into the worker processes
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(serve_workers), '--preload', '--bind', '127.0.0.1:8050', 'wsgi:application']
+    else:
+        command = [sys.executable, 'data_visualisation.py']
 
     # Run Dash using subprocess, this is to avoid everything gets run again when Dash creates a new subprocess 
-    process = subprocess.Popen([sys.executable, 'data_visualisation.py'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
     # Output everything from the subprocess to existing terminal
     for line in process.stdout:
         sys.stdout.write(line)
@@ -25,9 +58,20 @@ if  __name__ == "__main__":
     # take input
     parser = argparse.ArgumentParser()
     parser.add_argument('--fetch', action='store_true', help='Fetch new tweets')
+    parser.add_argument('--days', type=int, default=7, help='Number of past days fetched by --fetch')
     parser.add_argument('--train', action='store_true', help='Re-train all models')
-    parser.add_argument('--analyze', action='store_true', help='Re-analyze all models')
+    parser.add_argument('--select', nargs='*', metavar='MODEL', choices=list(model_selection.search_spaces), help='Tune the parameters of the Sklearn models (all of them unless names are given) by cross-validation, use with --train to analyse the best ones')
+    parser.add_argument('--analyze', action='store_true', help='Analyze the reviews added or changed since the last analysis')
+    parser.add_argument('--full-analysis', action='store_true', help='Make --analyze re-analyze every tweet instead of only the changed reviews')
+    parser.add_argument('--score', nargs='*', metavar='MODEL', help='Score the new tweets with the trained models (all of them unless names are given)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to train and analyze models (0 uses all cores)')
+    parser.add_argument('--serve-workers', type=int, default=0, help='Serve the dashboard with this many gunicorn worker processes instead of the development server')
+    parser.add_argument('--metrics-port', type=int, help='Serve the timers and counters of the run at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-log', metavar='PATH', help='Append every timed step of the run to this JSON lines file')
+    parser.add_argument('--profile', choices=metrics.profilers, help='Profile the run with cProfile or the low-overhead sampling profiler')
+    parser.add_argument('--profile-output', metavar='PATH', help='File the profile is written to (profile.pstats or profile.folded by default)')
 
     args = parser.parse_args()
 
-    main(fetch_new_tweets=args.fetch, retrain=args.train, reanalyze=args.analyze)
\ No newline at end of file
+    main(fetch_new_tweets=args.fetch, retrain=args.train, reanalyze=args.analyze, workers=args.workers, days=args.days, serve_workers=args.serve_workers, full_analysis=args.full_analysis, score=args.score,
+         metrics_port=args.metrics_port, metrics_log=args.metrics_log, profile=args.profile, profile_output=args.profile_output, select=args.select)
\ No newline at end of file
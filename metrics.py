@@ -0,0 +1,278 @@
+import os
+import sys
+import json
+import time
+import bisect
+import pstats
+import cProfile
+import datetime
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Lightweight instrumentation of the pipeline. Timers and counters are kept in memory by every process,
+# exposed in the Prometheus text format and, when a log is opened, written as one JSON object per line:
+#   with metrics.timer('model_train', model=name) as event:
+#       model.train(x, y)
+#       event['rows'] = len(x)
+# Work done in worker processes is only recorded if its timings are sent back to the main process
+
+# Bounds in seconds, from single queries to model training
+duration_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0)
+
+class LatencyHistogram:
+    """
+    Thread-safe histogram of durations in seconds
+    """
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def prometheus(self, name, labels):
+        with self._lock:
+            lines = []
+            total = 0
+            separator = ',' if labels else ''
+            for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+                total += count
+                lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {total}')
+            labels = f'{{{labels}}}' if labels else ''
+            lines.append(f'{name}_sum{labels} {self.sum}')
+            lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+def format_labels(labels):
+    # key="value" pairs of a Prometheus sample, labels is a tuple of (key, value)
+    return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels)
+
+class Registry:
+    """
+    Timers and counters of this process, by metric name and labels
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self._log = None
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, LatencyHistogram(duration_buckets))
+        histogram.observe(seconds)
+
+    def count(self, name, value=1, labels=()):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def open_log(self, path):
+        # Append events to a JSON lines file until close_log
+        with self._lock:
+            self._log = open(path, 'a', encoding='utf-8')
+
+    def close_log(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+    def log(self, event, **fields):
+        if self._log is None:
+            return
+        line = json.dumps({'time': datetime.datetime.now().isoformat(), 'pid': os.getpid(), 'event': event, **fields}, default=str)
+        with self._lock:
+            if self._log:
+                self._log.write(line + '\n')
+                self._log.flush()
+
+    def prometheus(self) -> str:
+        lines = []
+        # Copied first, other threads may add metrics meanwhile
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+            counters = sorted(self.counters.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), histogram in histograms:
+                if metric == name:
+                    lines += histogram.prometheus(name, format_labels(labels))
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f'# TYPE {name} counter')
+            lines += [f'{name}{{{format_labels(labels)}}} {value}' if labels else f'{name} {value}' for (metric, labels), value in counters if metric == name]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, limit=20):
+        # (name, labels, count, total seconds) of the timers that took the most time
+        with self._lock:
+            histograms = list(self.histograms.items())
+        rows = [(name, dict(labels), histogram.count, histogram.sum) for (name, labels), histogram in histograms]
+        return sorted(rows, key=lambda row: row[3], reverse=True)[:limit]
+
+registry = Registry()
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def record(name, seconds, rows=None, error=None, **labels):
+    # Record a duration measured elsewhere, e.g. in a worker process
+    key = labels_key(labels)
+    registry.observe(f'{name}_seconds', seconds, key)
+    if rows is not None:
+        registry.count(f'{name}_rows_total', rows, key)
+    if error is not None:
+        registry.count(f'{name}_errors_total', 1, key)
+    registry.log(name, labels=labels, seconds=round(seconds, 6), rows=rows, error=error)
+
+def count(name, value=1, **labels):
+    registry.count(f'{name}_total', value, labels_key(labels))
+
+@contextmanager
+def timer(name, **labels):
+    # Time the block, rows set on the yielded dict are counted with it
+    event = {}
+    error = None
+    start = time.perf_counter()
+    try:
+        yield event
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+        raise
+    finally:
+        record(name, time.perf_counter() - start, event.get('rows'), error, **labels)
+
+def print_summary(limit=20):
+    rows = registry.summary(limit)
+    if not rows:
+        return
+    print(f'{"timer":32} {"labels":48} {"count":>8} {"seconds":>10}')
+    for name, labels, count, seconds in rows:
+        labels = ', '.join(f'{key}={value}' for key, value in labels.items())
+        print(f'{name:32} {labels[:48]:48} {count:>8} {seconds:>10.3f}')
+
+#region endpoint
+def make_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+def serve(port=9464, host='127.0.0.1'):
+    # Serve GET /metrics from a background thread for as long as the process runs
+    server = ThreadingHTTPServer((host, port), make_handler(registry))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Metrics available at http://{host}:{port}/metrics')
+    return server
+#endregion
+
+#region profiling
+class SamplingProfiler:
+    """
+    Samples the stack of every other thread of this process every interval seconds,
+    leaving out threads that are idle (e.g. servers waiting for a connection, workers waiting for a queue).
+    Stacks are written in the collapsed format read by flame graph tools (e.g. flamegraph.pl, speedscope)
+    """
+    idle = {('selectors.py', 'select'), ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get')}
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in self.idle:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f'{stack} {samples}\n')
+
+    def top(self, limit=20):
+        # Functions at the top of the most samples
+        functions = Counter()
+        for stack, samples in self.stacks.items():
+            functions[stack.rsplit(';', 1)[-1]] += samples
+        return functions.most_common(limit)
+
+profilers = ('cprofile', 'sample')
+
+@contextmanager
+def profile(mode=None, path=None):
+    # Profile the block with cProfile (exact, slower) or the sampling profiler (low overhead), nothing if mode is None
+    if mode is None:
+        yield
+        return
+    if mode not in profilers:
+        raise ValueError(f'Unknown profiler {mode}, expected one of {", ".join(profilers)}')
+
+    if mode == 'cprofile':
+        path = path or 'profile.pstats'
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+            print(f'Profile written to {path} (open with python -m pstats {path})')
+    else:
+        path = path or 'profile.folded'
+        profiler = SamplingProfiler().start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.write(path)
+            total = sum(profiler.stacks.values())
+            print(f'{total} stacks sampled, functions seen most often on top of the stack:')
+            for function, samples in profiler.top():
+                print(f'{samples / max(total, 1):7.1%}  {function}')
+            print(f'Stacks written to {path}')
+#endregion
@@ -0,0 +1,66 @@
+import os
+import time
+import threading
+import joblib
+
+import db_manager
+
+
+def load_model(path):
+    # Arrays of the model are memory-mapped copy-on-write instead of read into memory,
+    # this needs the file path: joblib cannot memory-map from a file object
+    return joblib.load(path, mmap_mode='c')
+
+
+class ModelRegistry:
+    """
+    Saved models by name, each model is only deserialized on first use.
+    The time spent loading every model is kept in load_times (in seconds)
+    """
+    def __init__(self, paths):
+        self.paths = dict(paths)
+        self.load_times = {}
+        self._models = {}
+        self._locks = {name: threading.Lock() for name in self.paths}
+
+    @classmethod
+    def from_database(cls):
+        # Models saved by the last analysis
+        return cls({name: path for _, name, path in db_manager.get_analysis_models() or []})
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def available(self) -> bool:
+        # Whether every model has a saved file
+        return all(path and os.path.exists(path) for path in self.paths.values())
+
+    def get(self, name):
+        # The model, loaded on the first call, None if it cannot be loaded
+        if name in self._models:
+            return self._models[name]
+
+        with self._locks[name]:
+            if name not in self._models:
+                start = time.perf_counter()
+                try:
+                    self._models[name] = load_model(self.paths[name])
+                except Exception as err:
+                    print(f'Failed to load model {name}: {err}')
+                    return None
+                self.load_times[name] = time.perf_counter() - start
+                print(f'{name}: loaded in {self.load_times[name] * 1000:.1f} ms')
+        return self._models[name]
+
+    def items(self):
+        # (name, model) of every model that can be loaded, loading all of them
+        for name in self.paths:
+            model = self.get(name)
+            if model is not None:
+                yield name, model
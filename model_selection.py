@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.model_selection import StratifiedKFold, ParameterGrid, ParameterSampler
+
+import db_manager
+import metrics
+import data_analyzer
+from analysis_model import SklearnNBMD, SklearnSVM, SklearnSGD
+from feature_store import FeatureStore
+
+# Seeded k-fold cross-validation and hyperparameter search for the Sklearn models, on the training split of the analysis.
+#   python model_selection.py --models SklearnSVM --folds 5
+#   python model_selection.py --search random --iterations 20 --workers 0
+# The validation performance of every candidate on each fold is stored in analysis_performance ('fold 1', 'fold 2', ...),
+# with their mean ('cv') and the test performance of the best candidate ('test').
+# The best parameters are written to selected_params.json, the next --train analyses those models with the default ones
+
+# Parameters of the vectorizers, candidates sharing them share the feature matrices of every fold
+vectorizer_params = {'ngram_range', 'min_df', 'max_df', 'sublinear_tf', 'max_features', 'n_features'}
+
+# The logistic loss of SGDClassifier is named 'log_loss' since scikit-learn 1.1 and 'log' before (0.23.2 in environment.yaml)
+log_loss = 'log_loss' if tuple(int(part) for part in sklearn.__version__.split('.')[:2]) >= (1, 1) else 'log'
+
+# model: (class, parameter space)
+search_spaces = {
+    'SklearnNBMD': (SklearnNBMD, {
+        'ngram_range': [(1,1), (1,2), (1,3)],
+        'min_df': [1, 2],
+        'sublinear_tf': [False, True],
+        'alpha': [0.01, 0.1, 0.5, 1.0],
+    }),
+    'SklearnSVM': (SklearnSVM, {
+        'ngram_range': [(1,1), (1,2)],
+        'min_df': [1, 2],
+        'sublinear_tf': [False, True],
+        'kernel': ['linear', 'rbf'],
+        'C': [0.1, 1.0, 10.0],
+        'class_weight': [None, 'balanced'],
+    }),
+    'SklearnSGD': (SklearnSGD, {
+        'ngram_range': [(1,1), (1,2)],
+        'loss': ['hinge', log_loss, 'modified_huber'],
+        'alpha': [1e-6, 1e-5, 1e-4, 1e-3],
+        'penalty': ['l2', 'elasticnet'],
+    }),
+}
+
+scores = ('accuracy', 'precision', 'recall', 'f1')
+
+def params_key(params):
+    return tuple(sorted(params.items(), key=lambda item: item[0]))
+
+def get_candidates(space, search='grid', iterations=20, seed=0):
+    if search == 'grid':
+        return list(ParameterGrid(space))
+    # Sampled without replacement when every parameter is a list of values
+    return list(ParameterSampler(space, n_iter=iterations, random_state=seed))
+
+def evaluate_fold(model_class, shared_params, candidates, x_train, y_train, x_val, y_val, store_path):
+    # Train and validate every candidate sharing the vectorizer parameters on one fold.
+    # The fold is vectorized by the first candidate only, the others get its matrices from the feature store
+    store = FeatureStore(store_path)
+    results = []
+    for params in candidates:
+        start = time.perf_counter()
+        model = model_class(**shared_params, **params)
+        model.use_feature_store(store)
+        model.train(x_train, y_train)
+        classification = model.classify(x_val)
+        counts = [(sentiment, predicted, count) for _, sentiment, predicted, count in data_analyzer.count_classification('validation', y_val, classification)]
+        results.append((dict(shared_params, **params), time.perf_counter() - start, data_analyzer.get_performance(counts)))
+    return results
+
+def cross_validate(model_class, candidates, x, y, folds=5, seed=0, workers=1):
+    # {candidate key: [performance of every fold]}, folds of candidates with the same vectorizer parameters run together
+    groups = {}
+    for params in candidates:
+        shared = params_key({name: value for name, value in params.items() if name in vectorizer_params})
+        groups.setdefault(shared, []).append({name: value for name, value in params.items() if name not in vectorizer_params})
+
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(x, y))
+    tasks = [
+        (fold, (model_class, dict(shared), group, x.iloc[train], y.iloc[train], x.iloc[validation], y.iloc[validation], data_analyzer.feature_store_path))
+        for shared, group in groups.items()
+        for fold, (train, validation) in enumerate(splits)
+    ]
+
+    performance = {params_key(params): [None] * folds for params in candidates}
+    fit_times = {key: 0.0 for key in performance}
+
+    def store(fold, results):
+        for params, seconds, fold_performance in results:
+            performance[params_key(params)][fold] = fold_performance
+            fit_times[params_key(params)] += seconds
+            metrics.record('model_selection_fold', seconds, len(splits[fold][1]), model=model_class.__name__)
+
+    if not workers:
+        workers = os.cpu_count()
+    workers = min(workers, len(tasks))
+
+    print(f'{model_class.__name__}: {len(candidates)} candidates, {folds} folds, {len(tasks)} tasks on {workers} processes')
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(evaluate_fold, *arguments): fold for fold, arguments in tasks}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+    else:
+        for fold, arguments in tasks:
+            store(fold, evaluate_fold(*arguments))
+
+    return performance, fit_times
+
+def select_model(name, folds=5, search='grid', iterations=20, seed=None, workers=1, scoring='f1'):
+    seed = data_analyzer.split_seed if seed is None else seed
+    model_class, space = search_spaces[name]
+    candidates = get_candidates(space, search, iterations, seed)
+
+    # Only the training split is cross-validated, the test split is left for the best candidate
+    x_train, x_test, y_train, y_test = data_analyzer.get_dataset()
+    start = time.perf_counter()
+    performance, fit_times = cross_validate(model_class, candidates, x_train, y_train, folds, seed, workers)
+    print(f'{name}: cross-validation completed in {time.perf_counter() - start:.2f}s')
+
+    # Mean and standard deviation of every score over the folds
+    rows = []
+    for key, fold_performance in performance.items():
+        values = np.array(fold_performance, dtype=float)
+        rows.append({'params': dict(key), **dict(zip(scores, values.mean(axis=0))), 'std': values[:, scores.index(scoring)].std(), 'seconds': fit_times[key]})
+    ranking = pd.DataFrame(rows).sort_values(scoring, ascending=False, kind='stable')
+
+    best = ranking.iloc[0]['params']
+    model = model_class(**best)
+    model.use_feature_store(FeatureStore(data_analyzer.feature_store_path))
+    model.train(x_train, y_train)
+    classification = model.classify(x_test)
+    test_performance = data_analyzer.get_performance([(s, c, n) for _, s, c, n in data_analyzer.count_classification('test', y_test, classification)])
+
+    with db_manager.transaction():
+        for key, fold_performance in performance.items():
+            model_id = db_manager.add_analysis_model(model_class(**dict(key)).name, kind='selection')
+            for fold, values in enumerate(fold_performance, start=1):
+                db_manager.add_classification_performance(model_id, f'fold {fold}', *values)
+            db_manager.add_classification_performance(model_id, 'cv', *np.mean(fold_performance, axis=0).tolist())
+            if dict(key) == best:
+                db_manager.add_classification_performance(model_id, 'test', *test_performance)
+
+    print(f'{"candidate":70} {scoring:>8} {"std":>7} {"fit s":>8}')
+    for row in ranking.head(10).itertuples(index=False):
+        print(f'{model_class(**row.params).name:70} {getattr(row, scoring):>8.4f} {row.std:>7.4f} {row.seconds:>8.2f}')
+    print(f'{name}: best {model.name}, test accuracy {test_performance[0]:.4f}, f1 {test_performance[3]:.4f}')
+    return best
+
+def select_models(names=None, folds=5, search='grid', iterations=20, seed=None, workers=1, scoring='f1'):
+    names = names or list(search_spaces)
+    for name in names:
+        if name not in search_spaces:
+            raise ValueError(f'No search space for model {name}, expected one of {", ".join(search_spaces)}')
+
+    # Results of the previous selection are replaced
+    db_manager.clear_model_selection()
+    selected = {}
+    if os.path.exists(data_analyzer.selected_params_path):
+        with open(data_analyzer.selected_params_path, 'r', encoding='utf-8') as f:
+            selected = json.load(f)
+
+    for name in names:
+        with metrics.timer('model_selection', model=name):
+            selected[name] = select_model(name, folds, search, iterations, seed, workers, scoring)
+        # Written after every model, a model failing later does not lose the ones already tuned
+        with open(data_analyzer.selected_params_path, 'w', encoding='utf-8') as f:
+            json.dump(selected, f, indent=2)
+        print(f'Selected parameters of {name} written to {data_analyzer.selected_params_path}')
+
+    # Every fold of every vectorizer added an entry to the feature store
+    FeatureStore(data_analyzer.feature_store_path).prune(data_analyzer.feature_store_max_size, data_analyzer.feature_store_max_age)
+    return selected
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', nargs='*', choices=list(search_spaces), help='Models to tune (all by default)')
+    parser.add_argument('--folds', type=int, default=5, help='Number of cross-validation folds')
+    parser.add_argument('--search', choices=['grid', 'random'], default='grid', help='Try every combination of parameters, or a random sample of them')
+    parser.add_argument('--iterations', type=int, default=20, help='Number of candidates of a random search')
+    parser.add_argument('--seed', type=int, help='Seed of the folds and of the random search (the seed of the train/test split by default)')
+    parser.add_argument('--scoring', choices=scores, default='f1', help='Weighted score the candidates are ranked by')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes running folds in parallel (0 uses all cores)')
+
+    args = parser.parse_args()
+
+    select_models(args.models, args.folds, args.search, args.iterations, args.seed, args.workers, args.scoring)
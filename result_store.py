@@ -0,0 +1,90 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+
+import db_manager
+
+# Classifications of the analysed models, stored as columns in .npy files instead of one database row per tweet.
+# Every write of a model and label (train/test) is a new run of three files next to each other:
+#   <results_path>/<model_id>/<label>.<run>.ids.npy              tweet ids, int64
+#   <results_path>/<model_id>/<label>.<run>.classification.npy   classifications, int8
+#   <results_path>/<model_id>/<label>.<run>.sentiment.npy        reviewed sentiment they were evaluated against, int8
+# The analysis_results table points at the current run of each model and label. The files are memory-mapped on load,
+# the Series returned by read_classification use them without a copy
+
+results_path = './results'
+
+# Sentiment of classifications whose tweet has no reviewed sentiment
+missing_sentiment = -128
+
+def _file(prefix, column):
+    return f'{prefix}.{column}.npy'
+
+def _save(path, array):
+    # Written under another name first, a reader never maps a partial file
+    with open(f'{path}.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(f'{path}.tmp', path)
+
+def write_results(model_id, label, classification: pd.Series, sentiment: pd.Series = None, path=None):
+    # Replace the stored classifications of a model and label, sentiment is the reviewed sentiment of the same tweets
+    path = path or results_path
+    directory = os.path.join(path, str(model_id))
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, f'{label}.{time.time_ns():x}')
+
+    sentiment = sentiment.reindex(classification.index) if sentiment is not None else pd.Series(index=classification.index, dtype=float)
+    _save(_file(prefix, 'ids'), classification.index.to_numpy(dtype='int64'))
+    _save(_file(prefix, 'classification'), classification.to_numpy(dtype='int8'))
+    _save(_file(prefix, 'sentiment'), sentiment.fillna(missing_sentiment).to_numpy(dtype='int8'))
+
+    # Files of the previous run are deleted by prune_results, once the database no longer points at them
+    db_manager.set_analysis_result(model_id, label, prefix, len(classification))
+    return prefix
+
+def _load(prefix, column):
+    return np.load(_file(prefix, column), mmap_mode='r')
+
+def read_classification(model_id, label) -> pd.Series:
+    # Classifications indexed by tweet id, None if the model has none for the label
+    prefix = db_manager.get_analysis_result(model_id, label)
+    if prefix is None:
+        return None
+    return pd.Series(_load(prefix, 'classification'), index=pd.Index(_load(prefix, 'ids'), name='id', copy=False), name='classification', copy=False)
+
+def read_results(model_id) -> pd.DataFrame:
+    # label, classification and sentiment of every classification of a model, indexed by tweet id
+    frames = []
+    for label, prefix, _ in db_manager.get_analysis_results(model_id) or []:
+        sentiment = pd.Series(_load(prefix, 'sentiment'), dtype='float64')
+        frames.append(pd.DataFrame({
+            'label': label,
+            'classification': _load(prefix, 'classification'),
+            'sentiment': sentiment.where(sentiment != missing_sentiment).to_numpy(),
+        }, index=pd.Index(_load(prefix, 'ids'), name='id')))
+    if not frames:
+        return pd.DataFrame({'label': pd.Series(dtype=object), 'classification': pd.Series(dtype='int8'), 'sentiment': pd.Series(dtype=float)}, index=pd.Index([], dtype='int64', name='id'))
+    return pd.concat(frames)
+
+def prune_results(path=None):
+    # Delete the files of runs the database no longer points at, e.g. after the analysis tables are cleared.
+    # Files still mapped by another process may fail to delete on Windows, they are tried again next time
+    path = path or results_path
+    if not os.path.isdir(path):
+        return
+    current = {os.path.normpath(prefix) for prefix in db_manager.get_all_analysis_result_paths() or []}
+    for directory in os.listdir(path):
+        directory = os.path.join(path, directory)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            # <label>.<run>.<column>.npy, unfinished writes end with .tmp
+            prefix = os.path.join(directory, name.rsplit('.', 2)[0])
+            if os.path.normpath(prefix) not in current:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+        if not os.listdir(directory):
+            os.rmdir(directory)
@@ -0,0 +1,180 @@
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+
+import tweet_scoring
+from metrics import LatencyHistogram
+from text_cleaner import clean_series
+
+# Long-running HTTP service classifying texts with the trained models, which are loaded once at start-up.
+#   POST /score         {"text": "...", "models": [...]}    -> {"classification": {model: label}}
+#   POST /score/batch   {"texts": [...], "models": [...]}   -> {"classification": {model: [labels]}}
+#   GET  /models                                            -> {"models": [...]}
+#   GET  /metrics       per-model latency histograms in the Prometheus text format
+
+class ModelBatcher:
+    """
+    Classifies the requests of one model on its own thread.
+    Requests queued while the model is busy are classified together in one call,
+    so concurrent requests share one vectorizer and classifier call
+    """
+    def __init__(self, name, model, max_batch=1000):
+        self.name = name
+        self.model = model
+        self.max_batch = max_batch
+        self.latency = LatencyHistogram()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts) -> Future:
+        # Future of the classifications of texts, in order
+        future = Future()
+        start = time.perf_counter()
+        future.add_done_callback(lambda _: self.latency.observe(time.perf_counter() - start))
+        if texts:
+            self._queue.put((texts, future))
+        else:
+            future.set_result([])
+        return future
+
+    def _run(self):
+        while True:
+            # Wait for a request, then take whatever else is already queued up to max_batch texts
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            while size < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for texts, _ in batch for text in texts]
+            try:
+                classification = self.model.classify(clean_series(pd.Series(texts))).astype(int).tolist()
+            except Exception as err:
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+
+            offset = 0
+            for texts, future in batch:
+                future.set_result(classification[offset:offset + len(texts)])
+                offset += len(texts)
+
+class ScoringService:
+    def __init__(self, models):
+        self.batchers = {name: ModelBatcher(name, model) for name, model in models.items()}
+
+    def score(self, texts, names=None) -> dict:
+        names = names or list(self.batchers)
+        unknown = [name for name in names if name not in self.batchers]
+        if unknown:
+            raise KeyError(f'Unknown models: {", ".join(unknown)}')
+        # Submit to every model first so they classify at the same time
+        futures = {name: self.batchers[name].submit(texts) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def metrics(self) -> str:
+        lines = [
+            '# HELP scoring_latency_seconds Time from receiving a scoring request to its classification',
+            '# TYPE scoring_latency_seconds histogram',
+        ]
+        for name, batcher in self.batchers.items():
+            lines += batcher.latency.prometheus('scoring_latency_seconds', f'model="{name}"')
+        return '\n'.join(lines) + '\n'
+
+def make_handler(service):
+    class ScoringHandler(BaseHTTPRequestHandler):
+        # Keep connections open between requests, and send responses right away instead of waiting for Nagle's algorithm
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if self.path == '/models':
+                self._send_json(200, {'models': list(service.batchers)})
+            elif self.path == '/metrics':
+                self._send(200, service.metrics().encode('utf-8'), 'text/plain; version=0.0.4')
+            else:
+                self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path not in ('/score', '/score/batch'):
+                self._send_json(404, {'error': f'Unknown path {self.path}'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path == '/score':
+                    texts = [str(body['text'])]
+                else:
+                    texts = [str(text) for text in body['texts']]
+                models = body.get('models')
+            except (ValueError, KeyError, TypeError) as err:
+                self._send_json(400, {'error': f'Invalid request: {err}'})
+                return
+
+            try:
+                classification = service.score(texts, models)
+            except KeyError as err:
+                self._send_json(404, {'error': str(err.args[0])})
+                return
+            except Exception as err:
+                self._send_json(500, {'error': str(err)})
+                return
+
+            if self.path == '/score':
+                classification = {name: labels[0] for name, labels in classification.items()}
+            self._send_json(200, {'classification': classification})
+
+        def _send_json(self, status, content):
+            self._send(status, json.dumps(content).encode('utf-8'), 'application/json')
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Logging every request costs more than scoring it
+            pass
+
+    return ScoringHandler
+
+def serve(models=None, host='127.0.0.1', port=8060):
+    paths = tweet_scoring.find_models(models)
+    if not paths:
+        print(f'No trained models found in {tweet_scoring.trained_model_path}')
+        return
+
+    start = time.perf_counter()
+    service = ScoringService(tweet_scoring.load_models(paths))
+    print(f'Loaded {len(paths)} models in {time.perf_counter() - start:.2f}s: {", ".join(paths)}')
+
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    print(f'Scoring service listening on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', nargs='*', metavar='MODEL', help='Models to serve (all trained models by default)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8060, help='Port to listen on')
+
+    args = parser.parse_args()
+
+    serve(args.models, args.host, args.port)
@@ -0,0 +1,28 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import pytest
+
+# The modules of the project are at the root of the repository
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# db_manager creates ./db/database.db when it is imported, the tests run in a scratch directory
+scratch = tempfile.mkdtemp(prefix='tests_')
+atexit.register(shutil.rmtree, scratch, True)
+os.chdir(scratch)
+# config.py reads the (empty) API keys of config.ini when it is imported
+shutil.copy(os.path.join(root, 'config.ini'), scratch)
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # Empty database in the directory of the test
+    import db_manager
+    monkeypatch.chdir(tmp_path)
+    db_manager.close()
+    monkeypatch.setattr(db_manager, 'db_path', str(tmp_path / 'db' / 'database.db'))
+    db_manager.init()
+    yield db_manager
+    db_manager.close()
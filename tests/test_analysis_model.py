@@ -0,0 +1,47 @@
+import os
+import pickle
+import pandas as pd
+import pytest
+
+import textblob.sentiments
+
+import analysis_model
+from conftest import root
+from text_cleaner import clean_series
+
+@pytest.fixture(scope='module')
+def tweets():
+    texts = clean_series(pd.read_csv(os.path.join(root, 'reviewed_data.csv'), dtype=str, encoding='utf-8-sig', usecols=['text'])['text'].dropna())
+    # Shuffled, so the results have to follow the input order and not the index
+    return texts.sample(n=600, random_state=0)
+
+@pytest.mark.parametrize('model_class', [analysis_model.VaderModel, analysis_model.TextBlobDefaultPA])
+def test_classify_batch_keeps_order_and_index(model_class, tweets):
+    model = model_class()
+    expected = model.classify(tweets)
+    pd.testing.assert_series_equal(model.classify_batch(tweets, chunk_size=100, workers=2), expected)
+    pd.testing.assert_series_equal(model.classify_batch(tweets, chunk_size=100, workers=1), expected)
+
+    # Any iterable of texts, numbered in input order
+    classification = model.classify_batch(iter(tweets.tolist()), chunk_size=100, workers=2)
+    assert classification.tolist() == expected.tolist()
+    assert classification.index.tolist() == list(range(len(tweets)))
+
+def test_classify_chunks_yields_in_order(tweets):
+    model = analysis_model.VaderModel()
+    chunks = [tweets.iloc[start:start + 50] for start in range(0, len(tweets), 50)]
+    results = list(model.classify_chunks(iter(chunks), workers=2))
+    assert [result.index.tolist() for result in results] == [chunk.index.tolist() for chunk in chunks]
+
+def test_default_nba_is_trained_once(monkeypatch):
+    trainings = []
+    # The movie review corpus is not needed to count the trainings
+    monkeypatch.setattr(textblob.sentiments.NaiveBayesAnalyzer, 'train', lambda self: trainings.append(self))
+    model = analysis_model.TextBlobDefaultNBA()
+    model.train(None, None)
+    model.prepare()
+    assert len(trainings) == 1
+
+    # A saved model stays trained
+    pickle.loads(pickle.dumps(model)).prepare()
+    assert len(trainings) == 1
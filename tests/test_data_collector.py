@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+import time
+import pytest
+import tweepy
+
+import data_collector
+from tweet_replay import StubSearchAPI, ReplayCursor
+
+def make_tweet(tweet_id, created_at='Wed Apr 28 10:00:00 +0000 2021'):
+    return tweepy.models.Status.parse(None, {
+        'id': tweet_id,
+        'user': {'id': 1},
+        'in_reply_to_status_id': None,
+        'full_text': f'tweet {tweet_id}',
+        'created_at': created_at,
+        'place': None,
+        'favorite_count': 0,
+        'retweet_count': 0,
+    })
+
+def make_pages(ids, size=100):
+    # Newest first, like the search API
+    tweets = [make_tweet(tweet_id) for tweet_id in sorted(ids, reverse=True)]
+    return [tweets[start:start + size] for start in range(0, len(tweets), size)]
+
+def stored_ids(database):
+    return {row[0] for row in database.get_connection().execute('SELECT id FROM tweets').fetchall()}
+
+class BlockedWrites:
+    """
+    Wraps db_manager.add_tweets, the first write waits until release is set
+    """
+    def __init__(self, database, monkeypatch):
+        self.add_tweets = database.add_tweets
+        self.sizes = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        monkeypatch.setattr(database, 'add_tweets', self)
+
+    def __call__(self, tweets):
+        self.sizes.append(len(tweets))
+        self.started.set()
+        assert self.release.wait(10)
+        return self.add_tweets(tweets)
+
+def test_pages_queued_during_a_write_are_batched(database, monkeypatch):
+    writes = BlockedWrites(database, monkeypatch)
+    pages = make_pages(range(1, 11), size=2)
+    with data_collector.TweetWriter(batch_size=4, max_pending=10) as writer:
+        writer.put(pages[0])
+        assert writes.started.wait(10)
+        # Queued while the first page is written
+        for page in pages[1:]:
+            writer.put(page)
+        writes.release.set()
+
+    # The first page alone, then up to batch_size tweets per write
+    assert writes.sizes == [2, 4, 4]
+    assert writer.written == 10
+    assert stored_ids(database) == set(range(1, 11))
+
+def test_full_queue_blocks_the_fetch(database, monkeypatch):
+    writes = BlockedWrites(database, monkeypatch)
+    pages = make_pages(range(1, 9), size=2)
+    queued = []
+    # One page per write, so the page being written leaves the queue alone
+    writer = data_collector.TweetWriter(batch_size=2, max_pending=2).start()
+
+    def fetch():
+        for page in pages:
+            writer.put(page)
+            queued.append(page)
+    fetcher = threading.Thread(target=fetch, daemon=True)
+    fetcher.start()
+
+    assert writes.started.wait(10)
+    time.sleep(0.2)
+    # One page is being written and two wait in the queue, the fourth put blocks
+    assert len(queued) == 3
+    assert fetcher.is_alive()
+
+    writes.release.set()
+    fetcher.join(10)
+    writer.close()
+    assert len(queued) == 4
+    assert stored_ids(database) == set(range(1, 9))
+
+def test_interrupted_fetch_resumes_from_checkpoint(database):
+    pages = make_pages(range(1, 251))
+    # The endpoint fails after two pages of 100 tweets
+    api = StubSearchAPI(pages, fail_after=2)
+    assert data_collector.get_new_tweets(api=api, cursor=ReplayCursor) == 200
+    assert stored_ids(database) == set(range(51, 251))
+    checkpoints = database.get_connection().execute('SELECT since_id, max_id FROM fetch_checkpoints').fetchall()
+    assert checkpoints == [(None, 50)]
+
+    # Without the checkpoint, the next fetch would only look for tweets newer than the latest one stored
+    api = StubSearchAPI(pages)
+    assert data_collector.get_new_tweets(api=api, cursor=ReplayCursor) == 50
+    assert stored_ids(database) == set(range(1, 251))
+    assert database.get_connection().execute('SELECT COUNT(*) FROM fetch_checkpoints').fetchone()[0] == 0
+
+def test_failed_write_is_raised(database, monkeypatch):
+    def add_tweets(tweets):
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(database, 'add_tweets', add_tweets)
+    api = StubSearchAPI(make_pages(range(1, 1001)))
+
+    with pytest.raises(sqlite3.OperationalError):
+        data_collector.get_new_tweets(api=api, cursor=ReplayCursor)
+    assert stored_ids(database) == set()
+    # Nothing was stored, so there is no checkpoint to resume from either
+    assert database.get_connection().execute('SELECT COUNT(*) FROM fetch_checkpoints').fetchone()[0] == 0
+
+def test_failed_write_is_raised_by_backfill(database, monkeypatch):
+    def add_tweets(tweets):
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(database, 'add_tweets', add_tweets)
+    api = StubSearchAPI(make_pages(range(1, 301)))
+
+    with pytest.raises(sqlite3.OperationalError):
+        data_collector.backfill(range(2), items=100, api=api, cursor=ReplayCursor, rate_limiter=data_collector.TokenBucket(rate=1000, capacity=100))
+
+def test_token_bucket_waits_for_tokens():
+    # Two requests right away, then one every 50ms
+    bucket = data_collector.TokenBucket(rate=20, capacity=2)
+    start = time.perf_counter()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.perf_counter() - start >= 0.19
+
+def test_backfill_fetches_windows_concurrently(database):
+    # Every request takes 200ms, the five windows would take a second one after the other
+    api = StubSearchAPI(make_pages(range(1, 501)), latency=0.2)
+    start = time.perf_counter()
+    data_collector.backfill(range(5), items=100, api=api, cursor=ReplayCursor, rate_limiter=data_collector.TokenBucket(rate=1000, capacity=100))
+    assert time.perf_counter() - start < 0.6
+    assert api.requests == 5
+
+def test_backfill_stores_overlapping_windows_once(database):
+    # Tweets of the previous week are in every window, each is stored and counted once
+    api = StubSearchAPI(make_pages(range(1, 301)))
+    written = data_collector.backfill(range(4), items=300, api=api, cursor=ReplayCursor, rate_limiter=data_collector.TokenBucket(rate=1000, capacity=100))
+    assert stored_ids(database) == set(range(1, 301))
+    assert written == 300
+
+def test_backfill_shares_the_rate_limit(database):
+    # One request at once, then one every 100ms across all windows
+    api = StubSearchAPI(make_pages(range(1, 101)))
+    start = time.perf_counter()
+    data_collector.backfill(range(4), items=100, api=api, cursor=ReplayCursor, rate_limiter=data_collector.TokenBucket(rate=10, capacity=1))
+    assert time.perf_counter() - start >= 0.29
+    assert api.requests == 4
@@ -0,0 +1,72 @@
+import sqlite3
+import pytest
+
+def test_transaction_commits_once(database):
+    with database.transaction():
+        database.set_fetch_checkpoint('query', None, 10)
+        with database.transaction():
+            database.set_fetch_checkpoint('other', 1, 20)
+    assert database.get_fetch_checkpoint('query') == (None, 10)
+    assert database.get_fetch_checkpoint('other') == (1, 20)
+
+def test_caught_error_rolls_transaction_back(database):
+    # add_manually_reviewed_tweets prints its error instead of raising it, the writes before it must not be committed
+    with pytest.raises(sqlite3.Error):
+        with database.transaction():
+            database.set_fetch_checkpoint('query', None, 10)
+            database.add_manually_reviewed_tweets([('not an id', 1)])
+            database.set_fetch_checkpoint('other', 1, 20)
+    assert database.get_fetch_checkpoint('query') is None
+    assert database.get_fetch_checkpoint('other') is None
+
+    # The next transaction starts clean
+    with database.transaction():
+        database.set_fetch_checkpoint('query', None, 10)
+    assert database.get_fetch_checkpoint('query') == (None, 10)
+
+def test_exception_rolls_transaction_back(database):
+    with pytest.raises(KeyboardInterrupt):
+        with database.transaction():
+            database.set_fetch_checkpoint('query', None, 10)
+            raise KeyboardInterrupt
+    assert database.get_fetch_checkpoint('query') is None
+
+def test_caught_error_outside_transaction(database):
+    # Without a transaction the query is rolled back on its own and the error only printed
+    database.add_manually_reviewed_tweets([('not an id', 1)])
+    database.set_fetch_checkpoint('query', None, 10)
+    assert database.get_fetch_checkpoint('query') == (None, 10)
+
+def insert_tweets(database, ids):
+    database.get_connection().executemany('INSERT INTO tweets VALUES (?,?,?,?,?,?,?,?)', [(tweet_id, 1, None, f'tweet {tweet_id}', '2021-04-28 10:00:00', None, 0, 0) for tweet_id in ids])
+    database.get_connection().commit()
+
+def test_tweets_after_follow_the_ingest_order(database):
+    insert_tweets(database, [50, 10, 30])
+    # Duplicates are ignored and get no sequence number
+    insert_tweets(database, [10, 20])
+    rows = database.get_tweets_after(0, 10)
+    assert [tweet_id for _, tweet_id, _ in rows] == [50, 10, 30, 20]
+
+    mark = rows[-1][0]
+    database.get_connection().execute('VACUUM')
+    insert_tweets(database, [5])
+    assert [tweet_id for _, tweet_id, _ in database.get_tweets_after(mark, 10)] == [5]
+
+def test_migration_keeps_scoring_marks(database):
+    connection = database.get_connection()
+    # Database of the previous version, its marks are rowids of tweets
+    connection.executescript('''
+        DROP TRIGGER tweets_sequence;
+        DROP TABLE tweet_sequence;
+        DROP TABLE scoring_marks;
+        CREATE TABLE scoring_marks(model TEXT NOT NULL, version TEXT NOT NULL, last_rowid INTEGER NOT NULL, updated_at TEXT NOT NULL, PRIMARY KEY(model));
+        PRAGMA user_version = 7;
+    ''')
+    insert_tweets(database, [50, 10, 30])
+    connection.execute("INSERT INTO scoring_marks VALUES ('VaderMD', 'v1', 2, '')")
+    connection.commit()
+
+    database.migrate(connection.cursor())
+    assert database.get_scoring_marks() == {'VaderMD': ('v1', 2)}
+    assert [tweet_id for _, tweet_id, _ in database.get_tweets_after(2, 10)] == [30]
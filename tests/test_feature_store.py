@@ -0,0 +1,42 @@
+import os
+import time
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+
+from feature_store import FeatureStore, CachedVectorizer
+
+def add_entry(store, texts, used):
+    # Fit a vectorizer through the store, its entry was last used used seconds ago
+    vectorizer = CachedVectorizer(CountVectorizer(), store)
+    vectorizer.fit_transform(pd.Series(texts))
+    when = time.time() - used
+    os.utime(os.path.join(store.path, vectorizer.key), (when, when))
+    return vectorizer.key
+
+def test_prune_deletes_old_entries(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    old = add_entry(store, ['old tweets', 'from a previous split'], used=40 * 24 * 3600)
+    recent = add_entry(store, ['tweets of', 'the current split'], used=60)
+
+    assert store.prune(max_age=30 * 24 * 3600) == 1
+    assert os.listdir(tmp_path) == [recent]
+    # Deleted entries are fitted again instead of being served from memory
+    assert store.get_vectorizer(old) is None
+    assert store.get_vectorizer(recent) is not None
+
+def test_prune_keeps_the_store_under_its_size(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    keys = [add_entry(store, [f'split {n} tweet', f'another tweet {n}'], used=300 - n) for n in range(4)]
+    size = FeatureStore._size(os.path.join(tmp_path, keys[0]))
+
+    # Room for two entries, the least recently used go first
+    assert store.prune(max_size=2 * size + size // 2) == 2
+    assert sorted(os.listdir(tmp_path)) == sorted(keys[2:])
+
+def test_loading_an_entry_marks_it_used(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    key = add_entry(store, ['some tweets', 'to vectorize'], used=40 * 24 * 3600)
+
+    # Another process loads the entry from disk
+    assert FeatureStore(str(tmp_path)).get_vectorizer(key) is not None
+    assert store.prune(max_age=30 * 24 * 3600) == 0
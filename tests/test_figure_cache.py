@@ -0,0 +1,25 @@
+import gc
+
+import db_manager
+from figure_cache import FigureCache
+
+def test_cache_is_not_kept_alive_by_callbacks():
+    callbacks = len(db_manager.analysis_cleared_callbacks)
+    cache = FigureCache()
+    assert len(db_manager.analysis_cleared_callbacks) == callbacks + 1
+
+    del cache
+    gc.collect()
+    assert len(db_manager.analysis_cleared_callbacks) == callbacks
+
+def test_clearing_the_analysis_clears_live_caches(database, tmp_path):
+    cache = FigureCache(path=str(tmp_path / 'figures'))
+    cache.get(('performance', 'test', 'run'), lambda: [])
+    assert (tmp_path / 'figures').exists()
+
+    database.clear_analysis_tables()
+    assert not (tmp_path / 'figures').exists()
+    # Built again after the clear
+    built = []
+    cache.get(('performance', 'test', 'run'), lambda: built.append(1) or [])
+    assert built == [1]
@@ -0,0 +1,31 @@
+import json
+import pandas as pd
+import pytest
+
+import data_analyzer
+import model_selection
+
+def test_every_sgd_loss_trains():
+    x = pd.Series(['good vaccine', 'bad side effects', 'second dose today', 'great news', 'awful pain', 'clinic opens'])
+    y = pd.Series([1, -1, 0, 1, -1, 0])
+    model_class, space = model_selection.search_spaces['SklearnSGD']
+    for loss in space['loss']:
+        model = model_class(loss=loss)
+        model.train(x, y)
+        assert len(model.classify(x)) == len(x)
+
+def test_selected_params_are_written_after_every_model(database, tmp_path, monkeypatch):
+    path = tmp_path / 'selected_params.json'
+    monkeypatch.setattr(data_analyzer, 'selected_params_path', str(path))
+    monkeypatch.setattr(data_analyzer, 'feature_store_path', str(tmp_path / 'features'))
+
+    def select_model(name, *args):
+        if name == 'SklearnSGD':
+            raise ValueError('invalid loss')
+        return {'alpha': 0.1}
+    monkeypatch.setattr(model_selection, 'select_model', select_model)
+
+    with pytest.raises(ValueError):
+        model_selection.select_models(['SklearnNBMD', 'SklearnSVM', 'SklearnSGD'])
+    # The models tuned before the failure are kept
+    assert json.loads(path.read_text(encoding='utf-8')) == {'SklearnNBMD': {'alpha': 0.1}, 'SklearnSVM': {'alpha': 0.1}}
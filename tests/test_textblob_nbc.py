@@ -0,0 +1,75 @@
+import os
+import re
+import pandas as pd
+import pytest
+import textblob.classifiers
+import textblob.exceptions
+import textblob.tokenizers
+import textblob.utils
+
+from conftest import root
+from analysis_model import TextBlobNBC, TextBlobCompiledNBC
+from text_cleaner import clean_series
+from tweet_reviews import rate_scores
+
+def regex_word_tokenize(text, include_punc=True):
+    # TextBlob's word_tokenize without NLTK's punkt sentence tokenizer
+    tokens = re.findall(r"\w+|'\w+|[^\w\s]+", text)
+    if include_punc:
+        return tokens
+    return [word if word.startswith("'") else textblob.utils.strip_punc(word, all=False) for word in tokens if textblob.utils.strip_punc(word, all=False)]
+
+def punkt_available():
+    try:
+        list(textblob.tokenizers.word_tokenize('Is punkt here? Yes.'))
+        return True
+    except (LookupError, textblob.exceptions.MissingCorpusError):
+        return False
+
+@pytest.fixture(params=['textblob', 'regex'])
+def tokenizer(request, monkeypatch):
+    # Both classifiers tokenize with TextBlob's tokenizer, or both with the stand-in if NLTK's data is missing
+    if request.param == 'textblob':
+        if not punkt_available():
+            pytest.skip("NLTK's punkt tokenizer is not installed")
+        return
+    monkeypatch.setattr(textblob.tokenizers, 'word_tokenize', regex_word_tokenize)
+    monkeypatch.setattr(textblob.classifiers, 'word_tokenize', regex_word_tokenize)
+
+@pytest.fixture(scope='module')
+def reviews():
+    df = pd.read_csv(os.path.join(root, 'reviewed_data.csv'), dtype=str, encoding='utf-8-sig', usecols=['text', 'rate'])
+    df['sentiment'] = df['rate'].str.lower().map(rate_scores)
+    df = df.dropna(subset=['text', 'sentiment']).head(800)
+    return clean_series(df['text']), df['sentiment'].astype(int)
+
+def classify_both(x_train, y_train, x):
+    legacy, compiled = TextBlobNBC(), TextBlobCompiledNBC()
+    legacy.train(x_train, y_train)
+    compiled.train(x_train, y_train)
+    return legacy.classify(x).astype(int), compiled.classify(x).astype(int)
+
+def test_same_predictions_as_textblob(tokenizer, reviews):
+    x, y = reviews
+    half = len(x) // 2
+    # Tweets seen in training and unseen ones
+    legacy, compiled = classify_both(x.iloc[:half], y.iloc[:half], x)
+    pd.testing.assert_series_equal(compiled, legacy, check_names=False)
+
+def test_punctuation(tokenizer):
+    # Punctuation is stripped around words, "'s" is kept
+    x_train = pd.Series(['good day!', 'bad, bad news', 'a day', "it's good", '...bad', 'news.'])
+    y_train = pd.Series([1, -1, 0, 1, -1, 0])
+    x = pd.Series(['good', 'news!', 'unknown words', '', "it's", 'bad... day'])
+    legacy, compiled = classify_both(x_train, y_train, x)
+    pd.testing.assert_series_equal(compiled, legacy, check_names=False)
+
+def test_ties_go_to_the_largest_label(tokenizer):
+    # Classes with the same documents score exactly the same.
+    # Ties that only come from rounding depend on the order NLTK sums the words in, which follows the hash of a set
+    x_train = pd.Series(['good day', 'good day', 'bad news'])
+    y_train = pd.Series([1, 0, -1])
+    x = pd.Series(['good day', 'good', 'bad news'])
+    legacy, compiled = classify_both(x_train, y_train, x)
+    assert legacy.tolist() == [1, 1, -1]
+    pd.testing.assert_series_equal(compiled, legacy, check_names=False)
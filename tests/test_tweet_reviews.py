@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+import tweet_reviews
+
+def write_reviews(path, rows):
+    pd.DataFrame(rows, columns=['id', 'text', 'rate']).to_csv(path, index=False)
+
+def write_id_map(path, pairs):
+    pd.DataFrame(pairs, columns=['id', 'id_original']).to_csv(path, index=False)
+
+@pytest.fixture(autouse=True)
+def id_map_cache(monkeypatch):
+    # The id map of every test is loaded again
+    monkeypatch.setattr(tweet_reviews, '_id_map_cache', {})
+
+def stored_reviews(database):
+    return dict(database.get_connection().execute('SELECT tweet_id, sentiment FROM review_results').fetchall())
+
+def test_failed_chunk_rolls_back_import(database, tmp_path, monkeypatch):
+    write_reviews(tmp_path / 'reviews.csv', [(1, 'a', 'positive'), (2, 'b', 'negative'), (3, 'c', 'neutral')])
+    write_id_map(tmp_path / tweet_reviews.id_map_path, [(1, 1), (2, 2), (3, 3)])
+    add = database.add_manually_reviewed_tweets
+    calls = []
+    def add_failing(values):
+        # The second chunk fails inside the query, which only prints its error
+        calls.append(1)
+        add([('not an id', 1)] if len(calls) == 2 else values)
+    monkeypatch.setattr(database, 'add_manually_reviewed_tweets', add_failing)
+
+    tweet_reviews.import_csv(str(tmp_path / 'reviews.csv'), chunk_size=1)
+    assert len(calls) == 3
+    assert stored_reviews(database) == {}
+
+def test_import_maps_ids_and_skips_unmapped(database, tmp_path, capsys):
+    write_reviews(tmp_path / 'reviews.csv', [(10000, 'a', 'positive'), (20000, 'b', 'Irrelevant'), (30000, 'c', 'negative'), (40000, 'd', None)])
+    write_id_map(tmp_path / tweet_reviews.id_map_path, [(10000, 11234), (20000, 25678)])
+
+    tweet_reviews.import_csv(str(tmp_path / 'reviews.csv'))
+    # 30000 has no entry in the id map, the unreviewed 40000 is not counted
+    assert stored_reviews(database) == {11234: 1, 25678: None}
+    output = capsys.readouterr().out
+    assert '2 reviewed tweets imported' in output
+    assert '1 reviewed tweets skipped' in output
+
+def add_tweets(database, ids):
+    database.get_connection().executemany('INSERT INTO tweets VALUES (?,?,?,?,?,?,?,?)', [(tweet_id, 1, None, f'tweet {tweet_id}', '2021-04-28 10:00:00', None, 0, 0) for tweet_id in ids])
+    database.get_connection().commit()
+
+def test_export_shards_by_id(database, tmp_path):
+    add_tweets(database, [10, 11, 12, 14, 16])
+    database.add_manually_reviewed_tweets([(11, 1)])
+    tweet_reviews.export(str(tmp_path / 'unreviewed.csv'), shards=3)
+
+    shards = {shard: pd.read_csv(tmp_path / f'unreviewed_{shard}.csv')['id'].tolist() for shard in range(3)}
+    # 11 is reviewed
+    assert shards == {0: [12], 1: [10, 16], 2: [14]}
+
+def test_export_creates_no_empty_files(database, tmp_path):
+    add_tweets(database, [10, 13])
+    tweet_reviews.export(str(tmp_path / 'unreviewed.csv'), shards=3)
+    assert sorted(path.name for path in tmp_path.glob('unreviewed*')) == ['unreviewed_1.csv']
+
+    database.add_manually_reviewed_tweets([(10, 1), (13, 0)])
+    tweet_reviews.export(str(tmp_path / 'empty.csv'))
+    assert not list(tmp_path.glob('empty*'))
+
+@pytest.mark.parametrize('shards', [0, -1])
+def test_export_rejects_invalid_shards(database, tmp_path, shards):
+    with pytest.raises(ValueError):
+        tweet_reviews.export(str(tmp_path / 'unreviewed.csv'), shards=shards)
@@ -0,0 +1,34 @@
+import os
+import joblib
+import pandas as pd
+
+import tweet_scoring
+from analysis_model import VaderModel
+from text_cleaner import clean_series
+
+texts = ['I love it', 'Terrible side effects', 'Got my second dose', 'Best day ever!', 'So sad and angry', '@user RT worst news']
+
+def add_tweets(database, ids):
+    rows = [(tweet_id, 1, None, texts[tweet_id % len(texts)], '2021-04-28 10:00:00', None, 0, 0) for tweet_id in ids]
+    database.get_connection().executemany('INSERT INTO tweets VALUES (?,?,?,?,?,?,?,?)', rows)
+    database.get_connection().commit()
+
+def expected(ids):
+    tweets = pd.Series([texts[tweet_id % len(texts)] for tweet_id in ids], index=ids)
+    return dict(VaderModel().classify(clean_series(tweets)))
+
+def test_score_tweets_resumes_after_the_mark(database):
+    os.mkdir('trained_models')
+    joblib.dump(VaderModel(), os.path.join('trained_models', 'VaderMD.joblib'))
+    # Ingest order differs from the id order
+    add_tweets(database, [30, 10, 20, 50, 40])
+
+    assert tweet_scoring.score_tweets(chunk_size=2, workers=2) == 5
+    assert dict(database.get_predictions('VaderMD')) == expected([10, 20, 30, 40, 50])
+    assert database.get_scoring_marks()['VaderMD'][1] == 5
+
+    # Only the new tweets are scored by the next run
+    assert tweet_scoring.score_tweets(chunk_size=2, workers=2) == 0
+    add_tweets(database, [5, 60])
+    assert tweet_scoring.score_tweets(chunk_size=2, workers=1) == 2
+    assert dict(database.get_predictions('VaderMD')) == expected([5, 10, 20, 30, 40, 50, 60])
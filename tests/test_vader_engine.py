@@ -0,0 +1,36 @@
+import os
+import pandas as pd
+import pytest
+import vaderSentiment.vaderSentiment as vader
+
+from conftest import root
+from analysis_model import BaseModel, VaderModel
+from text_cleaner import clean_series
+from vader_engine import VaderEngine
+
+@pytest.fixture(scope='module')
+def tweets():
+    # Cleaned like the analysis cleans them
+    texts = pd.read_csv(os.path.join(root, 'reviewed_data.csv'), dtype=str, encoding='utf-8-sig', usecols=['text'])['text'].dropna()
+    return clean_series(texts)
+
+@pytest.fixture(scope='module')
+def legacy(tweets):
+    # VaderModel.classify before vader_engine, one polarity_scores call per tweet
+    analyzer = vader.SentimentIntensityAnalyzer()
+    return tweets.apply(lambda x: analyzer.polarity_scores(x)['compound'])
+
+def test_compound_matches_polarity_scores(tweets, legacy):
+    compound = VaderEngine().compound(tweets)
+    assert compound.index.equals(tweets.index)
+    assert (compound - legacy).abs().max() <= 1e-4
+
+def test_classify_matches_polarity_scores(tweets, legacy):
+    classification = VaderModel().classify(tweets)
+    pd.testing.assert_series_equal(classification, legacy.apply(BaseModel.sentiment_score), check_names=False, check_dtype=False)
+
+def test_emojis_are_replaced_like_polarity_scores():
+    analyzer = vader.SentimentIntensityAnalyzer()
+    texts = pd.Series(['😀', 'great 😀', 'sad😢 day', '😢😀 what', 'no emoji here'])
+    expected = texts.apply(lambda x: analyzer.polarity_scores(x)['compound'])
+    assert (VaderEngine().compound(texts) - expected).abs().max() <= 1e-4
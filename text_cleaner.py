@@ -0,0 +1,33 @@
+import re
+import pandas as pd
+
+import db_manager
+
+# Bumped whenever the cleaning changes, texts cleaned by another version are never reused
+cleaner_version = 1
+
+# @mentions, hashtag signs, RT markers and hyperlinks, removed in a single pass.
+# Unlike one re.sub per pattern, a removal cannot join its neighbours into a new match (e.g. 'R#T '),
+# which gives the same result on every tweet of reviewed_data.csv
+pattern = re.compile(r'@[A-Za-z0-9]+|#|RT\s+|https?://\S+')
+
+def clean_text(tweet):
+    return pattern.sub('', tweet)
+
+def clean_series(texts: pd.Series) -> pd.Series:
+    return texts.str.replace(pattern, '', regex=True)
+
+def clean_tweets(texts: pd.Series) -> pd.Series:
+    # Clean texts indexed by tweet id, reusing and storing the cleaned texts in the database
+    if texts.empty:
+        return clean_series(texts)
+
+    cached = db_manager.get_cleaned_tweets(texts.index.unique().tolist(), cleaner_version) or []
+    cached = pd.Series(dict(cached), dtype=object)
+
+    missing = texts[~texts.index.isin(cached.index)]
+    cleaned = clean_series(missing[~missing.index.duplicated()])
+    if len(cleaned):
+        db_manager.add_cleaned_tweets(zip(cleaned.index.tolist(), cleaned.tolist()), cleaner_version)
+
+    return pd.concat([cached, cleaned]).reindex(texts.index).rename(texts.name)
@@ -0,0 +1,72 @@
+import json
+import time
+import threading
+import tweepy
+
+# Offline stand-ins for the Twitter search API, used to exercise data_collector without network access
+
+def record_pages(pages, path):
+    # Save pages of tweets as the raw JSON returned by the API
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([[tweet._json for tweet in page] for page in pages], f)
+
+def load_pages(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [[tweepy.models.Status.parse(None, tweet) for tweet in page] for page in json.load(f)]
+
+class StubSearchAPI:
+    """
+    Serves recorded tweets through a search method with the same paging parameters as tweepy.API.search.
+    latency simulates the network round trip of each request (in seconds),
+    fail_after makes the endpoint raise after that many requests to simulate an interrupted fetch
+    """
+    def __init__(self, pages, latency=0, fail_after=None):
+        tweets = {tweet.id: tweet for page in pages for tweet in page}
+        # Newest first, like the search API
+        self.tweets = sorted(tweets.values(), key=lambda tweet: tweet.id, reverse=True)
+        self.latency = latency
+        self.fail_after = fail_after
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def search(self, q=None, since_id=None, max_id=None, until=None, count=15, **kwargs):
+        with self._lock:
+            self.requests += 1
+            requests = self.requests
+        if self.fail_after is not None and requests > self.fail_after:
+            raise tweepy.TweepError('Stub search endpoint failure')
+        time.sleep(self.latency)
+
+        results = []
+        for tweet in self.tweets:
+            if max_id is not None and tweet.id > max_id:
+                continue
+            if since_id is not None and tweet.id <= since_id:
+                break
+            if until is not None and tweet.created_at.date() >= until:
+                continue
+            results.append(tweet)
+            if len(results) == count:
+                break
+        return results
+
+class ReplayCursor:
+    """
+    Drop-in for tweepy.Cursor: pages through a search method by max_id like tweepy's IdIterator
+    """
+    def __init__(self, method, *args, **kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def pages(self, limit=0):
+        kwargs = dict(self.kwargs)
+        max_id = kwargs.pop('max_id', None)
+        count = 0
+        while not limit or count < limit:
+            page = self.method(*self.args, max_id=max_id, **kwargs)
+            if not page:
+                return
+            count += 1
+            yield page
+            max_id = min(tweet.id for tweet in page) - 1
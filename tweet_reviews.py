@@ -1,54 +1,151 @@
 import db_manager
+import sqlite3
 import pandas as pd
+import numpy as np
 import os.path
+import csv
+
+
+class CsvShardWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['id', 'text'])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+class ParquetShardWriter:
+    def __init__(self, path):
+        # pyarrow is only needed for parquet exports
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([('id', pa.string()), ('text', pa.string())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        ids, texts = zip(*rows)
+        self.writer.write_table(self.pa.Table.from_arrays([self.pa.array(ids), self.pa.array(texts)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+shard_writers = {
+    'csv': CsvShardWriter,
+    'parquet': ParquetShardWriter,
+}
+
+def export(path, shards=1, file_format='csv', batch_size=10000):
+    if shards < 1:
+        raise ValueError(f'shards must be at least 1, got {shards}')
+    if file_format not in shard_writers:
+        raise ValueError(f'Unknown export format {file_format}, expected one of {", ".join(shard_writers)}')
+
+    # Split the output into numbered files (e.g. unreviewed_0.csv) for separate labeling teams
+    root, ext = os.path.splitext(path)
+    paths = [path] if shards == 1 else [f'{root}_{shard}{ext}' for shard in range(shards)]
+    # Files are only created once they have tweets to write
+    writers = [None] * shards
+
+    exported = 0
+    try:
+        for tweets in db_manager.iter_unreviewed_tweets(batch_size):
+            rows = [[] for _ in writers]
+            for tweet_id, text in tweets:
+                # Ids are written as strings so spreadsheet tools cannot round them
+                rows[tweet_id % shards].append((str(tweet_id), text))
+            for shard, shard_rows in enumerate(rows):
+                if shard_rows:
+                    if writers[shard] is None:
+                        writers[shard] = shard_writers[file_format](paths[shard])
+                    writers[shard].write(shard_rows)
+            exported += len(tweets)
+    finally:
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+
+    if not exported:
+        print('No unreviewed tweets available')
+        return
 
+    print(f'{exported} unreviewed tweets exported to {sum(writer is not None for writer in writers)} file(s)')
 
-def export(path):
-
-    tweets = db_manager.get_unreviewed_tweets()
 
-    if not tweets:
+# Tweet ids were corrupted when the review file was exported (last 4 digits became 0s),
+# id_map.csv maps the corrupted ids back to the original ones
+id_map_path = 'id_map.csv'
 
-        print('No reviewed tweets available')
+# Scores of the reviewer ratings, other ratings (e.g. irrelevant) are stored as NULL
+rate_scores = {'positive': 1, 'neutral': 0, 'negative': -1}
 
-        return
+# Id map loaded by this process, keyed by (path, modification time)
+_id_map_cache = {}
 
-    df = pd.DataFrame(tweets, columns=["id", "text"])
+def get_id_map(path=id_map_path):
+    # Return the id map as int64 arrays (ids sorted, original ids), prebuilt next to the database
+    key = (path, os.path.getmtime(path))
+    if key in _id_map_cache:
+        return _id_map_cache[key]
 
-    df.to_csv(path, index=False, sep=',', encoding="utf-8")
+    index_path = os.path.join(os.path.dirname(db_manager.db_path), 'id_map_index.npz')
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= key[1]:
+        with np.load(index_path) as index:
+            if str(index['path']) == os.path.abspath(path):
+                _id_map_cache.clear()
+                _id_map_cache[key] = (index['ids'], index['id_original'])
+                return _id_map_cache[key]
 
+    df_map = pd.read_csv(path, dtype='str')
+    ids = np.asarray(df_map['id'], dtype='int64')
+    id_original = np.asarray(df_map['id_original'], dtype='int64')
+    order = np.argsort(ids, kind='stable')
+    ids, id_original = ids[order], id_original[order]
+    np.savez(index_path, ids=ids, id_original=id_original, path=os.path.abspath(path))
 
-def import_csv(path):
-    
-    # read the csv file from path
-    df = pd.read_csv(path, dtype='str')
-
-    # tweet id corrupted when export csv file (last 4 digits became 0s)
-    # this part of code is to fix the id issue
-    df_map = pd.read_csv('id_map.csv', dtype='str')
-    df = pd.merge(df, df_map, on='id')
-    df = df[['id_original','rate']]
-    
-    # filter unreviewed
-    df = df.loc[df['rate'].notna()]
+    _id_map_cache.clear()
+    _id_map_cache[key] = (ids, id_original)
+    return ids, id_original
 
-    # convert rate string into int
+def import_csv(path, chunk_size=100000):
     
-    def __rate_to_score(row):
-        value = row['rate'].lower()
-        if value == 'positive':
-            return 1
-        if value == 'neutral':
-            return 0
-        if value == 'negative':
-            return -1
-        return None
-
-    df['score'] = df.apply(__rate_to_score, axis=1)
-
-    values = map(lambda row: (row[1]['id_original'], row[1]['score']), df.iterrows())
+    map_ids, map_id_original = get_id_map()
+
+    imported = 0
+    unmapped = 0
+    # One commit for the whole file, the csv itself is read chunk by chunk
+    try:
+        with db_manager.transaction():
+            for df in pd.read_csv(path, dtype='str', usecols=['id', 'rate'], chunksize=chunk_size):
+
+                # filter unreviewed, ids that are not plain integers (e.g. 1.38737E+18) cannot be in the id map
+                df = df.loc[df['rate'].notna() & df['id'].str.fullmatch(r'\d+', na=False)]
+
+                # fix the corrupted ids, rows without an entry in the id map are dropped
+                ids = np.asarray(df['id'], dtype='int64')
+                position = np.minimum(np.searchsorted(map_ids, ids), len(map_ids) - 1)
+                found = map_ids[position] == ids
+
+                # convert rate string into int
+                score = df['rate'].str.lower().map(rate_scores).astype('Int8')[found]
+                score = score.astype(object).where(score.notna(), None)
+
+                values = zip(map_id_original[position[found]].tolist(), score.tolist())
+                db_manager.add_manually_reviewed_tweets(values)
+                imported += int(found.sum())
+                unmapped += int((~found).sum())
+    except sqlite3.Error as err:
+        # A failed chunk rolls back the whole file
+        print(f'Failed to import reviewed tweets, none were imported: {err}')
+        return
 
-    db_manager.add_manually_reviewed_tweets(values)
+    print(f'{imported} reviewed tweets imported')
+    if unmapped:
+        print(f'{unmapped} reviewed tweets skipped, their ids are not in {id_map_path}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,84 @@
+import os
+import glob
+import time
+from collections import deque
+import pandas as pd
+
+import db_manager
+import metrics
+from model_registry import ModelRegistry
+from data_analyzer import trained_model_path, model_version
+from text_cleaner import clean_series
+
+# Batch scoring of every stored tweet with the trained models, results go to the predictions table
+
+def find_models(names=None, path=trained_model_path):
+    # name: path of the saved models, all of them unless names are given
+    paths = {os.path.splitext(os.path.basename(file))[0]: file for file in sorted(glob.glob(os.path.join(path, '*.joblib')))}
+    if names:
+        for name in names:
+            if name not in paths:
+                print(f'Trained model not found: {name}')
+        paths = {name: paths[name] for name in names if name in paths}
+    return paths
+
+def load_models(paths):
+    models = {}
+    for name, model in ModelRegistry(paths).items():
+        # Every chunk is only transformed once, keep it out of the feature store
+        model.use_feature_store(None)
+        model.prepare()
+        models[name] = model
+    return models
+
+def score_tweets(models=None, chunk_size=10000, workers=1):
+    paths = find_models(models)
+    if not paths:
+        print(f'No trained models found in {trained_model_path}')
+        return 0
+    versions = {name: model_version(path) for name, path in paths.items()}
+
+    # Continue after the last tweet each model scored, from the start if the model changed since
+    stored = db_manager.get_scoring_marks() or {}
+    marks = {name: stored[name][1] if name in stored and stored[name][0] == versions[name] else 0 for name in paths}
+
+    if not workers:
+        workers = os.cpu_count()
+
+    print(f'Scoring tweets with {len(paths)} models: {", ".join(paths)}')
+    start = time.perf_counter()
+    scored = 0
+    for name, model in load_models(paths).items():
+        scored = max(scored, score_model(name, model, versions[name], marks[name], chunk_size, workers))
+
+    print(f'Scoring completed: {scored} tweets in {time.perf_counter() - start:.2f}s')
+    return scored
+
+def score_model(name, model, version, mark, chunk_size=10000, workers=1):
+    # Classify the tweets after the high-water mark of the model with its worker pool, returns the number of tweets scored
+    # Sequence number of the last tweet of every chunk handed to the model, in order
+    chunk_marks = deque()
+
+    def chunks():
+        # Page through the tweets by ingest sequence, only the chunks in flight are held in memory
+        seq = mark
+        while True:
+            rows = db_manager.get_tweets_after(seq, chunk_size)
+            if not rows:
+                return
+            seq = rows[-1][0]
+            chunk_marks.append(seq)
+            df = pd.DataFrame(rows, columns=['seq', 'id', 'text']).set_index('id')
+            # Caching the cleaned texts would cost more than cleaning them
+            yield clean_series(df['text'])
+
+    scored = 0
+    with metrics.timer('model_score', model=name) as event:
+        for classification in model.classify_chunks(chunks(), workers):
+            # Predictions and mark are committed together, an interrupted run resumes after the last stored chunk
+            with db_manager.transaction():
+                db_manager.add_predictions(name, classification.index.tolist(), classification.astype(int).tolist())
+                db_manager.set_scoring_mark(name, version, chunk_marks.popleft())
+            scored += len(classification)
+        event['rows'] = scored
+    return scored
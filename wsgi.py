@@ -0,0 +1,9 @@
+# WSGI entry point of the dashboard for multi-process servers, for example
+#   gunicorn --workers 4 --preload --bind 127.0.0.1:8050 wsgi:application
+# With --preload the snapshot is loaded and every figure is built once before the workers are forked,
+# the workers then share the memory-mapped snapshot and the figure files on disk.
+# gunicorn does not run on Windows, waitress serves the same application with threads instead:
+#   waitress-serve --threads 8 --port 8050 wsgi:application
+import data_visualisation
+
+application = data_visualisation.create_app(background_warm=False).server